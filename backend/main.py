@@ -4,29 +4,45 @@ URL-grounded analysis + Gemini-powered streamed negotiation.
 """
 
 import asyncio
+import copy
+import functools
 import hashlib
 import hmac
+import itertools
 import json
 import logging
+import multiprocessing
 import os
-import queue
+import pickle
 import random
 import re
+import secrets
+import ssl
+import string
 import threading
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
 from datetime import datetime
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-import requests
+import certifi
+import httpx
+import orjson
 from bs4 import BeautifulSoup
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from google.protobuf.json_format import MessageToDict
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
 from pydantic import BaseModel, HttpUrl
 from reportlab.lib.pagesizes import letter
@@ -35,9 +51,50 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from typing_extensions import TypedDict
 from xml.sax.saxutils import escape as xml_escape
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    from uvicorn.protocols.utils import ClientDisconnected
+except ImportError:
+    ClientDisconnected = None
+
+try:
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    ConnectionClosed = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is importable.
+except ImportError:
+    h2 = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("negotiation-arena")
 
@@ -63,11 +120,68 @@ def _env_bool(name: str, default: bool) -> bool:
 DEFAULT_NEGOTIATION_MAX_ROUNDS = _env_int("NEGOTIATION_MAX_ROUNDS", 10, 1, 50)
 NEGOTIATION_MAX_ROUNDS_LIMIT = _env_int("NEGOTIATION_MAX_ROUNDS_LIMIT", 20, 1, 100)
 AUTH_TOKEN_TTL_SECONDS = _env_int("AUTH_TOKEN_TTL_SECONDS", 43200, 60, 604800)
+AUTH_TOKENS_MAX_SIZE = _env_int("AUTH_TOKENS_MAX_SIZE", 10_000, 100, 1_000_000)
+SESSION_TTL_SECONDS = _env_int("SESSION_TTL_SECONDS", 86400, 300, 604800)
+SESSION_STORE_MAX_SIZE = _env_int("SESSION_STORE_MAX_SIZE", 5_000, 10, 1_000_000)
 NEGOTIATION_DEBUG_TRACE = _env_bool("NEGOTIATION_DEBUG_TRACE", True)
+# Anything other than an explicit truthy value (including typos like "flase") keeps the pipeline off.
+RAG_PIPELINE_ENABLED = _env_bool("RAG_PIPELINE_ENABLED", False)
 NEGOTIATION_STREAM_CONSOLE_LOG = _env_bool("NEGOTIATION_STREAM_CONSOLE_LOG", True)
 NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS = _env_int("NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS", 25, 5, 120)
-
-app = FastAPI(title="AI Negotiation Arena")
+NEGOTIATION_STREAM_BATCH_WINDOW_MS = _env_int("NEGOTIATION_STREAM_BATCH_WINDOW_MS", 20, 0, 250)
+# Structured student retries send one uncached call by default. Raising this fans out identical concurrent
+# candidates (each costs a call and a _GEMINI_SEM slot) so a drifted answer can skip the guarded rewrite.
+STUDENT_RETRY_CANDIDATES = _env_int("STUDENT_RETRY_CANDIDATES", 1, 1, 4)
+NEGOTIATION_STREAM_BATCH_MAX_CHARS = _env_int("NEGOTIATION_STREAM_BATCH_MAX_CHARS", 4096, 64, 65536)
+# The web client always asks for demo_mode, so its server-side pacing sleeps (per chunk and per round)
+# apply to every session; set to false to keep demo_mode's frame ordering without the added delay.
+NEGOTIATION_DEMO_PACING = _env_bool("NEGOTIATION_DEMO_PACING", True)
+# 0 renders reports on a thread instead of worker processes.
+PDF_WORKER_PROCESSES = _env_int("PDF_WORKER_PROCESSES", min(4, os.cpu_count() or 1), 0, 64)
+GEMINI_MAX_CONNECTIONS = _env_int("GEMINI_MAX_CONNECTIONS", 64, 1, 512)
+GEMINI_HTTP2 = _env_bool("GEMINI_HTTP2", True)
+# Opens the next ai_vs_ai counsellor stream as soon as the student's <message> closes. Off by default:
+# the counsellor request is sent before the student turn's stats/intent finish streaming.
+SPECULATIVE_COUNSELLOR_PREFETCH = _env_bool("SPECULATIVE_COUNSELLOR_PREFETCH", False)
+GEMINI_MAX_INFLIGHT = _env_int("GEMINI_MAX_INFLIGHT", 32, 1, 512)
+GEMINI_RETRY_ATTEMPTS = _env_int("GEMINI_RETRY_ATTEMPTS", 4, 1, 8)
+GEMINI_RESPONSE_CACHE_TTL_SECONDS = _env_int("GEMINI_RESPONSE_CACHE_TTL_SECONDS", 3600, 0, 86400)
+GEMINI_CONTEXT_CACHE_ENABLED = _env_bool("GEMINI_CONTEXT_CACHE_ENABLED", False)
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = _env_int("GEMINI_CONTEXT_CACHE_TTL_SECONDS", 3600, 300, 86400)
+# Gemini rejects explicit caches below ~1024 tokens, so tiny prefixes are always sent inline.
+GEMINI_CONTEXT_CACHE_MIN_CHARS = _env_int("GEMINI_CONTEXT_CACHE_MIN_CHARS", 4096, 0, 10_000_000)
+
+
+@asynccontextmanager
+async def _lifespan(application: FastAPI) -> AsyncIterator[None]:
+    get_http_client()
+    _start_trace_writer()
+    _start_store_purge()
+    # Warm disk-backed lookups off the event loop so the first request does not pay for them.
+    await asyncio.to_thread(_load_persona_identity_names)
+    application.state.pdf_fonts = await asyncio.to_thread(_configure_pdf_fonts)
+    await asyncio.to_thread(get_pdf_styles)
+    application.state.pdf_pool = get_pdf_pool()
+    if application.state.pdf_pool is not None:
+        # Start one worker now; it imports this module and builds fonts and styles before the first report.
+        application.state.pdf_pool.submit(get_pdf_styles)
+    try:
+        application.state.genai_client = get_client_and_models()[0]
+    except RuntimeError as exc:
+        logger.warning("Gemini client not configured at startup: %s", exc)
+    try:
+        yield
+    finally:
+        await _stop_store_purge()
+        await _stop_trace_writer()
+        await _close_http_client()
+        _shutdown_pdf_pool()
+        if CLIENT is not None:
+            await CLIENT.aio.aclose()
+            CLIENT.close()
+
+
+app = FastAPI(title="AI Negotiation Arena", lifespan=_lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -85,10 +199,29 @@ def _configure_models() -> Tuple[genai.Client, str, str]:
     if not negotiation_model_name:
         raise RuntimeError("GEMINI_MODEL is not set")
     judge_model_name = os.getenv("GEMINI_JUDGE_MODEL", negotiation_model_name)
-    client = genai.Client(api_key=api_key)
+    # Keep-alive pools on both transports so every Gemini call reuses warm TLS/HTTP connections.
+    limits = httpx.Limits(max_connections=GEMINI_MAX_CONNECTIONS, max_keepalive_connections=GEMINI_MAX_CONNECTIONS)
+    transport_args: Dict[str, Any] = {"limits": limits}
+    if GEMINI_HTTP2 and h2 is not None:
+        # Concurrent turns, retries and judge calls multiplex as streams over one connection per host.
+        transport_args["http2"] = True
+    # google-genai sends async calls through aiohttp (pulled in by litellm) unless async_client_args carries
+    # an explicit httpx transport, so the pool, HTTP/2 and TLS settings live on that transport. httpx ignores
+    # client-level verify once a transport is given; the context mirrors the one genai builds for httpx.
+    ssl_context = ssl.create_default_context(
+        cafile=os.environ.get("SSL_CERT_FILE", certifi.where()),
+        capath=os.environ.get("SSL_CERT_DIR"),
+    )
+    http_options = types.HttpOptions(
+        client_args=dict(transport_args),
+        async_client_args={"transport": httpx.AsyncHTTPTransport(verify=ssl_context, **transport_args)},
+    )
+    client = genai.Client(api_key=api_key, http_options=http_options)
     return client, negotiation_model_name, judge_model_name
 
 
+# Process-wide singleton built once (at startup or first use). Never reassign CLIENT at runtime:
+# callers hold references to it and its pooled connections live for the whole process.
 CLIENT: Optional[genai.Client] = None
 NEGOTIATION_MODEL_NAME: Optional[str] = None
 JUDGE_MODEL_NAME: Optional[str] = None
@@ -101,6 +234,56 @@ def get_client_and_models() -> Tuple[genai.Client, str, str]:
     return CLIENT, NEGOTIATION_MODEL_NAME, JUDGE_MODEL_NAME
 
 
+SCRAPE_USER_AGENT = "Mozilla/5.0"
+SCRAPE_MAX_BYTES = _env_int("SCRAPE_MAX_BYTES", 2 * 1024 * 1024, 64 * 1024, 64 * 1024 * 1024)
+URL_CONTENT_CACHE_TTL_SECONDS = _env_int("URL_CONTENT_CACHE_TTL_SECONDS", 900, 0, 86400)
+PROGRAM_CONTENT_MAX_CHARS = 25000
+EMBEDDED_JSON_MAX_CHARS = _env_int("EMBEDDED_JSON_MAX_CHARS", 200_000, 1024, 10_000_000)
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # Shared pooled client so URL scraping reuses keep-alive connections across requests.
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None or HTTP_CLIENT.is_closed:
+        HTTP_CLIENT = httpx.AsyncClient(
+            timeout=httpx.Timeout(20.0),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+            headers={"User-Agent": SCRAPE_USER_AGENT},
+            follow_redirects=True,
+        )
+    return HTTP_CLIENT
+
+
+async def _close_http_client() -> None:
+    global HTTP_CLIENT
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        HTTP_CLIENT = None
+
+
+PDF_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    # ReportLab is pure-Python and CPU bound; render in separate processes so the event loop stays free.
+    # Spawned workers avoid forking a process that already runs the event loop and SDK threads.
+    global PDF_POOL
+    if PDF_POOL is None and PDF_WORKER_PROCESSES > 0:
+        PDF_POOL = ProcessPoolExecutor(
+            max_workers=PDF_WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return PDF_POOL
+
+
+def _shutdown_pdf_pool() -> None:
+    global PDF_POOL
+    if PDF_POOL is not None:
+        PDF_POOL.shutdown(wait=False, cancel_futures=True)
+        PDF_POOL = None
+
+
 ARCHETYPE_LABELS: Dict[str, str] = {
     "desperate_switcher": "Desperate Switcher",
     "skeptical_shopper": "Skeptical Shopper",
@@ -179,6 +362,93 @@ ARCHETYPE_CONFIGS: Dict[str, Dict[str, str]] = {
         "language_instruction": "Direct, focused on discounts, corporate loyalty, exchange bonuses, and referral benefits.",
     },
 }
+ARCHETYPE_IDS: Tuple[str, ...] = tuple(ARCHETYPE_CONFIGS)
+PRODUCT_ARCHETYPE_IDS = frozenset({"car_buyer", "discount_hunter"})
+NEGOTIATION_MODES: Tuple[str, ...] = ("ai_vs_ai", "human_vs_ai", "agent_powered_human_vs_ai")
+HUMAN_NEGOTIATION_MODES = frozenset({"human_vs_ai", "agent_powered_human_vs_ai"})
+
+# Prompt fragments that depend only on the archetype (and mode), resolved once at import.
+_HINDI_COUNSELLOR_LANGUAGE_RULES = (
+    "LANGUAGE REQUIREMENT:\n"
+    "- Speak only in natural Hindi (Devanagari script).\n"
+    "- No Hinglish, no English code-mixing.\n"
+    "- This rule applies from the very first counsellor turn."
+)
+_ENGLISH_COUNSELLOR_LANGUAGE_RULES = (
+    "LANGUAGE REQUIREMENT:\n"
+    "- Use clear, professional English matching the active simulation style."
+)
+_PROGRAM_COUNSELLOR_PROFILE: Dict[str, str] = {
+    "role_title": "Senior Admissions Counsellor",
+    "objective_term": "enrollment",
+    "product_label": "PROGRAM",
+    "do_not_rules": (
+        "- Promise guaranteed jobs\n"
+        "- Overstate placement outcomes\n"
+        "- Invent program details"
+    ),
+    "customer_term": "student",
+    "intent_examples": "fee, placement, eligibility, curriculum, duration, financing, outcomes, comparison, trust-risk",
+    "nudge_examples": (
+        "  - \"Would you like a quick view of the capstone outcomes?\"\n"
+        "  - \"Should I break down placement eligibility in 30 seconds?\"\n"
+        "  - \"Do you want a fee + EMI snapshot for your case?\""
+    ),
+    "language_rules": _ENGLISH_COUNSELLOR_LANGUAGE_RULES,
+}
+_PRODUCT_COUNSELLOR_PROFILE: Dict[str, str] = {
+    "role_title": "Expert Product Specialist / Sales Executive",
+    "objective_term": "purchase",
+    "product_label": "PRODUCT",
+    "do_not_rules": (
+        "- Promise unrealistic discounts\n"
+        "- Overstate product features or warranty\n"
+        "- Invent product specifications"
+    ),
+    "customer_term": "customer",
+    "intent_examples": "price, features, warranty, specifications, financing, delivery, comparison, trust-risk",
+    "nudge_examples": (
+        "  - \"Would you like a quick breakdown of the key features?\"\n"
+        "  - \"Should I explain the warranty and service terms in 30 seconds?\"\n"
+        "  - \"Do you want a price + EMI snapshot for this model?\""
+    ),
+    "language_rules": _ENGLISH_COUNSELLOR_LANGUAGE_RULES,
+}
+COUNSELLOR_ARCHETYPE_PROFILE: Dict[str, Dict[str, str]] = {
+    archetype_id: {
+        **(_PRODUCT_COUNSELLOR_PROFILE if archetype_id in PRODUCT_ARCHETYPE_IDS else _PROGRAM_COUNSELLOR_PROFILE),
+        **({"language_rules": _HINDI_COUNSELLOR_LANGUAGE_RULES} if archetype_id == "skeptical_shopper" else {}),
+    }
+    for archetype_id in ARCHETYPE_IDS
+}
+_HINDI_STUDENT_LANGUAGE_PROFILE: Dict[str, str] = {
+    "language_style": "Hindi",
+    "language_instruction": "Respond only in natural Hindi (Devanagari script). No Hinglish or English phrases.",
+    "vocabulary": "फीस, प्लेसमेंट, नौकरी, भरोसा, रिटर्न ऑन इन्वेस्टमेंट, करियर ग्रोथ",
+    "pipeline_language_fragment": (
+        "- Mandatory language rule: speak only in Hindi (Devanagari).\n"
+        "- Never use Hinglish/code-mix.\n"
+        "- If counsellor speaks English, still reply in Hindi."
+    ),
+}
+_UK_ENGLISH_STUDENT_LANGUAGE_PROFILE: Dict[str, str] = {
+    "language_style": "UK English",
+    "language_instruction": "Use pure UK English only. No Hinglish, no Hindi words, and no code-mixing.",
+    "vocabulary": "career progression, return on investment, placement outcomes, programme structure, practical projects",
+    "pipeline_language_fragment": (
+        "- Human-vs-AI pipeline rule: respond only in natural UK English.\n"
+        "- Never use colloquial Hindi/Hinglish terms (for example: bhaiya, yaar, kya, paisa, scene)."
+    ),
+}
+# (archetype_id, mode) pairs missing here take the persona's own language style.
+STUDENT_LANGUAGE_PROFILE: Dict[Tuple[str, str], Dict[str, str]] = {
+    (archetype_id, mode): (
+        _HINDI_STUDENT_LANGUAGE_PROFILE if archetype_id == "skeptical_shopper" else _UK_ENGLISH_STUDENT_LANGUAGE_PROFILE
+    )
+    for archetype_id in ARCHETYPE_IDS
+    for mode in NEGOTIATION_MODES
+    if archetype_id == "skeptical_shopper" or mode in HUMAN_NEGOTIATION_MODES
+}
 
 PERSONA_VOICE_CATALOG_FILE = Path(__file__).resolve().parent / "config" / "persona_voice_catalog.json"
 PERSONA_IDENTITY_CATALOG: Optional[Dict[str, Any]] = None
@@ -206,24 +476,41 @@ def _load_persona_identity_catalog() -> Dict[str, Any]:
     return PERSONA_IDENTITY_CATALOG
 
 
-def _pick_persona_identity(archetype_id: str) -> Tuple[str, str]:
+PERSONA_IDENTITY_NAMES: Optional[Dict[str, Dict[str, Tuple[str, ...]]]] = None
+_DEFAULT_IDENTITY_KEY = ""
+
+
+def _clean_identity_names(source: Dict[str, Any]) -> Dict[str, Tuple[str, ...]]:
+    male_names = tuple(str(x).strip() for x in (source.get("male") or []) if str(x).strip())
+    female_names = tuple(str(x).strip() for x in (source.get("female") or []) if str(x).strip())
+    return {
+        "male": male_names or ("Aman", "Rahul", "Rohan", "Rajesh"),
+        "female": female_names or ("Riya", "Neha", "Anjali", "Priya"),
+    }
+
+
+def _load_persona_identity_names() -> Dict[str, Dict[str, Tuple[str, ...]]]:
+    # Sanitized name tuples per archetype, built once from the catalog.
+    global PERSONA_IDENTITY_NAMES
+    if PERSONA_IDENTITY_NAMES is not None:
+        return PERSONA_IDENTITY_NAMES
     catalog = _load_persona_identity_catalog()
     overrides = catalog.get("archetype_overrides", {}) if isinstance(catalog, dict) else {}
     default = catalog.get("default", {}) if isinstance(catalog, dict) else {}
-    source = overrides.get(archetype_id) if isinstance(overrides, dict) else None
-    if not isinstance(source, dict):
-        source = default if isinstance(default, dict) else {}
+    names = {_DEFAULT_IDENTITY_KEY: _clean_identity_names(default if isinstance(default, dict) else {})}
+    if isinstance(overrides, dict):
+        for archetype_id, source in overrides.items():
+            if isinstance(source, dict):
+                names[str(archetype_id)] = _clean_identity_names(source)
+    PERSONA_IDENTITY_NAMES = names
+    return PERSONA_IDENTITY_NAMES
 
-    male_names = [str(x).strip() for x in (source.get("male") or []) if str(x).strip()]
-    female_names = [str(x).strip() for x in (source.get("female") or []) if str(x).strip()]
-    if not male_names:
-        male_names = ["Aman", "Rahul", "Rohan", "Rajesh"]
-    if not female_names:
-        female_names = ["Riya", "Neha", "Anjali", "Priya"]
 
-    gender = random.choice(["male", "female"])
-    name = random.choice(male_names if gender == "male" else female_names)
-    return name, gender
+def _pick_persona_identity(archetype_id: str) -> Tuple[str, str]:
+    names = _load_persona_identity_names()
+    source = names.get(archetype_id) or names[_DEFAULT_IDENTITY_KEY]
+    gender = "male" if random.random() < 0.5 else "female"
+    return random.choice(source[gender]), gender
 
 
 class ProgramSummary(TypedDict):
@@ -340,10 +627,19 @@ class NegotiationState(TypedDict):
     deal_status: str
     negotiation_metrics: Dict[str, Any]
     retry_context: Dict[str, Any]
-
-
-SESSION_STORE: Dict[str, Dict[str, Any]] = {}
-AUTH_TOKENS: Dict[str, float] = {}
+    prompt_headers: Dict[str, str]
+    transcript_tail: Deque[str]
+    primary_objections_lc: str
+    archetype_id_lc: str
+    judge_transcript_lines: List[str]
+
+
+# Bounded in-memory stores; entries expire on their own so long-running processes do not grow forever.
+# Both are only touched from the event loop (cachetools caches are not thread-safe).
+SESSION_STORE: TTLCache = TTLCache(maxsize=SESSION_STORE_MAX_SIZE, ttl=SESSION_TTL_SECONDS)
+AUTH_TOKENS: TTLCache = TTLCache(maxsize=AUTH_TOKENS_MAX_SIZE, ttl=AUTH_TOKEN_TTL_SECONDS)
+STORE_PURGE_INTERVAL_SECONDS = 60
+_STORE_PURGE_TASK: Optional[asyncio.Task] = None
 AUTH_FILE = Path(__file__).with_name("auth.json")
 TRACE_OUTPUT_ROOT = Path(__file__).resolve().parent / "outputs" / "tracebility" / "runtime"
 TRACE_PIPELINE_DIRS: Dict[str, str] = {
@@ -355,36 +651,60 @@ PDF_HINDI_FONT_NAME = "CloseWireHindi"
 PDF_HINDI_FONT_BOLD_NAME = "CloseWireHindiBold"
 
 
-def _pipeline_trace_dir(mode: str) -> Path:
+# Per-folder (debug trace, traceability) files, resolved once instead of on every trace event.
+_PIPELINE_TRACE_FILES: Dict[str, Tuple[Path, Path]] = {
+    folder: (
+        TRACE_OUTPUT_ROOT / folder / "negotiation_debug_trace.jsonl",
+        TRACE_OUTPUT_ROOT / folder / "conversation_traceability.json",
+    )
+    for folder in set(TRACE_PIPELINE_DIRS.values())
+}
+# Directories already created by this process; skips a mkdir syscall per trace line.
+_TRACE_DIRS_READY: Set[Path] = set()
+
+
+def _pipeline_trace_files(mode: str) -> Tuple[Path, Path]:
     normalized = str(mode or "ai_vs_ai").strip().lower()
-    folder = TRACE_PIPELINE_DIRS.get(normalized, "ai_vs_ai")
-    return TRACE_OUTPUT_ROOT / folder
+    return _PIPELINE_TRACE_FILES[TRACE_PIPELINE_DIRS.get(normalized, "ai_vs_ai")]
 
 
 def _pipeline_debug_trace_file(mode: str) -> Path:
-    return _pipeline_trace_dir(mode) / "negotiation_debug_trace.jsonl"
+    return _pipeline_trace_files(mode)[0]
 
 
 def _pipeline_traceability_file(mode: str) -> Path:
-    return _pipeline_trace_dir(mode) / "conversation_traceability.json"
+    return _pipeline_trace_files(mode)[1]
+
+
+def _ensure_trace_dir(directory: Path) -> None:
+    if directory not in _TRACE_DIRS_READY:
+        directory.mkdir(parents=True, exist_ok=True)
+        _TRACE_DIRS_READY.add(directory)
 
 
 def _is_rag_pipeline_enabled() -> bool:
-    raw = str(os.getenv("RAG_PIPELINE_ENABLED", "false")).strip().lower()
-    # Accept common typo "flase" as false to avoid accidental activation.
-    if raw in {"1", "true", "yes", "on"}:
-        return True
-    if raw in {"0", "false", "flase", "no", "off", ""}:
-        return False
-    return False
+    return RAG_PIPELINE_ENABLED
+
+
+_DEVANAGARI_RE = re.compile("[\u0900-\u097F]")
 
 
 def _has_devanagari(value: str) -> bool:
-    text = str(value or "")
-    return any("\u0900" <= ch <= "\u097F" for ch in text)
+    return _DEVANAGARI_RE.search(str(value or "")) is not None
+
+
+PDF_FONTS: Optional[Tuple[str, str]] = None
 
 
 def _configure_pdf_fonts() -> Tuple[str, str]:
+    # Font discovery and TTF registration are per process; do them once and reuse the result.
+    global PDF_FONTS
+    if PDF_FONTS is None:
+        PDF_FONTS = _register_pdf_fonts()
+    return PDF_FONTS
+
+
+def _register_pdf_fonts() -> Tuple[str, str]:
     base_font = "Helvetica"
     bold_font = "Helvetica-Bold"
     candidate_paths = [
@@ -418,6 +738,10 @@ def _configure_pdf_fonts() -> Tuple[str, str]:
         return base_font, bold_font
 
 
+# Post-session jobs outlive their websocket handler; the event loop only keeps weak references to tasks.
+POST_SESSION_TASKS: Set[asyncio.Task] = set()
+
+
 async def _run_post_session_jobs_safe(session_id: str, mode: str, trace_payload: Dict[str, Any]) -> None:
     if not _is_rag_pipeline_enabled():
         _write_debug_trace(
@@ -447,7 +771,7 @@ async def _run_post_session_jobs_safe(session_id: str, mode: str, trace_payload:
     except Exception as exc:
         _write_debug_trace(
             "post_session_jobs_failed",
-            {
+            lambda: {
                 "mode": mode,
                 "session_id": session_id,
                 "error_type": type(exc).__name__,
@@ -455,6 +779,13 @@ async def _run_post_session_jobs_safe(session_id: str, mode: str, trace_payload:
             },
         )
 
+
+# Send failures that mean the peer is gone (uvicorn's wsproto and websockets transports, Starlette).
+_WS_DISCONNECT_ERRORS: Tuple[type, ...] = tuple(
+    cls for cls in (WebSocketDisconnect, ClientDisconnected, ConnectionClosed) if cls is not None
+)
+
+
 class ClientStreamClosed(Exception):
     """Raised when the websocket client disconnects during streaming."""
 
@@ -463,6 +794,14 @@ def _sha256_hex(value: str) -> str:
     return hashlib.sha256(value.encode("utf-8")).hexdigest()
 
 
+def _prompt_fingerprint(value: str) -> str:
+    # Trace correlation only; no collision resistance needed, so skip SHA-256 on multi-KB prompts.
+    data = value.encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
 def _load_password_hash() -> str:
     default_hash = _sha256_hex("agenticaimagic2026")
     if not AUTH_FILE.exists():
@@ -479,14 +818,45 @@ def _load_password_hash() -> str:
 
 
 PASSWORD_SHA256 = _load_password_hash()
+try:
+    PASSWORD_SHA256_DIGEST = bytes.fromhex(PASSWORD_SHA256)
+except ValueError:
+    logger.error("auth.json password_sha256 is not valid hex; login will reject every password")
+    PASSWORD_SHA256_DIGEST = b""
 
 
 def _issue_auth_token() -> str:
-    token = uuid.uuid4().hex
-    AUTH_TOKENS[token] = datetime.now().timestamp() + AUTH_TOKEN_TTL_SECONDS
+    token = secrets.token_hex(16)
+    AUTH_TOKENS[token] = True
     return token
 
 
+async def _purge_expired_entries_loop() -> None:
+    # TTLCache only evicts on mutation; sweep periodically so idle processes also release memory.
+    while True:
+        await asyncio.sleep(STORE_PURGE_INTERVAL_SECONDS)
+        AUTH_TOKENS.expire()
+        SESSION_STORE.expire()
+
+
+def _start_store_purge() -> None:
+    global _STORE_PURGE_TASK
+    if _STORE_PURGE_TASK is None:
+        _STORE_PURGE_TASK = asyncio.create_task(_purge_expired_entries_loop())
+
+
+async def _stop_store_purge() -> None:
+    global _STORE_PURGE_TASK
+    task, _STORE_PURGE_TASK = _STORE_PURGE_TASK, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
 def _truncate_trace_text(value: Any, limit: int = 240) -> str:
     text = str(value or "")
     if len(text) <= limit:
@@ -512,17 +882,105 @@ def _collect_chunk_finish_reasons(chunk: Any) -> List[str]:
     return reasons
 
 
+_MESSAGE_TERMINAL_SUFFIXES = (".", "!", "?", "\"", "'", ")", "]", "}", "```", "</message>")
+
+
 def _looks_truncated_message(text: str) -> bool:
-    value = (text or "").strip()
-    if not value:
+    # Only the tail matters, so rstrip avoids copying leading whitespace away.
+    value = text.rstrip() if text else ""
+    return bool(value) and not value.endswith(_MESSAGE_TERMINAL_SUFFIXES)
+
+
+TRACE_QUEUE_MAX_SIZE = 10_000
+TRACE_WRITE_BATCH_SIZE = 64
+# Background trace writer state; only touched from the event loop that started it.
+_TRACE_QUEUE: Optional[asyncio.Queue] = None
+_TRACE_WRITER_TASK: Optional[asyncio.Task] = None
+_TRACE_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _append_trace_lines(lines_by_file: Dict[Path, List[str]], handles: Dict[Path, Any]) -> None:
+    for target_file, lines in lines_by_file.items():
+        handle = handles.get(target_file)
+        if handle is None:
+            _ensure_trace_dir(target_file.parent)
+            handle = target_file.open("a", encoding="utf-8")
+            handles[target_file] = handle
+        handle.write("".join(lines))
+        handle.flush()
+
+
+async def _trace_writer_loop(trace_queue: asyncio.Queue) -> None:
+    handles: Dict[Path, Any] = {}
+    try:
+        while True:
+            item = await trace_queue.get()
+            stop = item is None
+            batch = [] if stop else [item]
+            while not stop and len(batch) < TRACE_WRITE_BATCH_SIZE and not trace_queue.empty():
+                next_item = trace_queue.get_nowait()
+                if next_item is None:
+                    stop = True
+                    break
+                batch.append(next_item)
+            if batch:
+                lines_by_file: Dict[Path, List[str]] = {}
+                for target_file, line in batch:
+                    lines_by_file.setdefault(target_file, []).append(line)
+                try:
+                    await asyncio.to_thread(_append_trace_lines, lines_by_file, handles)
+                except Exception:
+                    logger.exception("Failed to write %s debug trace lines", len(batch))
+            if stop:
+                return
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+
+def _start_trace_writer() -> None:
+    global _TRACE_QUEUE, _TRACE_WRITER_TASK, _TRACE_LOOP
+    if not NEGOTIATION_DEBUG_TRACE or _TRACE_WRITER_TASK is not None:
+        return
+    _TRACE_LOOP = asyncio.get_running_loop()
+    _TRACE_QUEUE = asyncio.Queue(maxsize=TRACE_QUEUE_MAX_SIZE)
+    _TRACE_WRITER_TASK = asyncio.create_task(_trace_writer_loop(_TRACE_QUEUE))
+
+
+async def _stop_trace_writer() -> None:
+    global _TRACE_QUEUE, _TRACE_WRITER_TASK, _TRACE_LOOP
+    trace_queue, task = _TRACE_QUEUE, _TRACE_WRITER_TASK
+    # Detach first so events raised during shutdown fall back to synchronous writes.
+    _TRACE_QUEUE, _TRACE_WRITER_TASK, _TRACE_LOOP = None, None, None
+    if trace_queue is None or task is None:
+        return
+    await trace_queue.put(None)
+    await task
+
+
+def _enqueue_trace_line(target_file: Path, line: str) -> bool:
+    if _TRACE_QUEUE is None:
         return False
-    terminal = (".", "!", "?", "\"", "'", ")", "]", "}", "```", "</message>")
-    return not value.endswith(terminal)
+    try:
+        if asyncio.get_running_loop() is not _TRACE_LOOP:
+            return False
+    except RuntimeError:
+        # Called from a worker thread; asyncio.Queue is not thread-safe.
+        return False
+    try:
+        _TRACE_QUEUE.put_nowait((target_file, line))
+    except asyncio.QueueFull:
+        return False
+    return True
 
 
-def _write_debug_trace(event: str, payload: Dict[str, Any]) -> None:
+def _write_debug_trace(event: str, payload: Union[Dict[str, Any], Callable[[], Dict[str, Any]]]) -> None:
+    # Payloads that hash or truncate large text can be passed as a zero-arg callable, so that work is
+    # skipped entirely when tracing is off.
     if not NEGOTIATION_DEBUG_TRACE:
         return
+    if callable(payload):
+        payload = payload()
     mode = str(payload.get("mode", "ai_vs_ai")).strip().lower()
     target_file = _pipeline_debug_trace_file(mode)
     entry = {
@@ -531,9 +989,12 @@ def _write_debug_trace(event: str, payload: Dict[str, Any]) -> None:
         **payload,
     }
     try:
-        target_file.parent.mkdir(parents=True, exist_ok=True)
+        line = _to_json_text(entry) + "\n"
+        if _enqueue_trace_line(target_file, line):
+            return
+        _ensure_trace_dir(target_file.parent)
         with target_file.open("a", encoding="utf-8") as handle:
-            handle.write(json.dumps(_to_plain_json(entry), ensure_ascii=False) + "\n")
+            handle.write(line)
     except Exception:
         logger.exception("Failed to write debug trace event=%s", event)
 
@@ -566,19 +1027,13 @@ def _emit_conversation_traceability(session_id: str, state: NegotiationState, an
     trace_payload = _build_traceability_payload(session_id, state, analysis)
     mode = str(state.get("mode", "ai_vs_ai")).strip().lower()
     target_file = _pipeline_traceability_file(mode)
-    target_file.parent.mkdir(parents=True, exist_ok=True)
+    _ensure_trace_dir(target_file.parent)
     target_file.write_text(json.dumps(trace_payload, indent=2, ensure_ascii=False), encoding="utf-8")
 
 
 def _validate_auth_token(token: str) -> bool:
-    expiry = AUTH_TOKENS.get(token)
-    now = datetime.now().timestamp()
-    if not expiry:
-        return False
-    if now > expiry:
-        AUTH_TOKENS.pop(token, None)
-        return False
-    return True
+    # TTLCache membership already accounts for expiry (monotonic clock).
+    return token in AUTH_TOKENS
 
 
 def _require_auth_token(token: str) -> None:
@@ -586,6 +1041,9 @@ def _require_auth_token(token: str) -> None:
         raise HTTPException(status_code=401, detail="Unauthorized: invalid or expired auth token")
 
 
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{[\s\S]*\})\s*```", re.IGNORECASE)
+
+
 def _safe_json_loads(text: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
     payload = (text or "").strip()
     if not payload:
@@ -599,7 +1057,7 @@ def _safe_json_loads(text: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
         pass
 
     # Try markdown fenced JSON blocks.
-    fenced = re.search(r"```(?:json)?\s*(\{[\s\S]*\})\s*```", payload, flags=re.IGNORECASE)
+    fenced = _FENCED_JSON_RE.search(payload)
     if fenced:
         try:
             return json.loads(fenced.group(1))
@@ -620,69 +1078,205 @@ def _safe_json_loads(text: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
     return fallback
 
 
-def _to_plain_json(value: Any) -> Any:
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def _orjson_default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, "_pb"):
+        try:
+            return MessageToDict(value._pb, preserving_proto_field_name=True)
+        except Exception:
+            pass
+    if hasattr(value, "items"):
+        try:
+            return {str(k): v for k, v in value.items()}
+        except Exception:
+            pass
+    if hasattr(value, "__iter__"):
+        try:
+            return list(value)
+        except Exception:
+            pass
+    return str(value)
+
+
+def _to_plain_json_slow(value: Any) -> Any:
     if value is None or isinstance(value, (str, int, float, bool)):
         return value
     if isinstance(value, dict):
-        return {str(k): _to_plain_json(v) for k, v in value.items()}
+        return {str(k): _to_plain_json_slow(v) for k, v in value.items()}
     if isinstance(value, (list, tuple, set)):
-        return [_to_plain_json(v) for v in value]
+        return [_to_plain_json_slow(v) for v in value]
     if hasattr(value, "_pb"):
         try:
-            return _to_plain_json(MessageToDict(value._pb, preserving_proto_field_name=True))
+            return _to_plain_json_slow(MessageToDict(value._pb, preserving_proto_field_name=True))
         except Exception:
             pass
     if hasattr(value, "items"):
         try:
-            return {str(k): _to_plain_json(v) for k, v in value.items()}
+            return {str(k): _to_plain_json_slow(v) for k, v in value.items()}
         except Exception:
             pass
     if hasattr(value, "__iter__"):
         try:
-            return [_to_plain_json(v) for v in list(value)]
+            return [_to_plain_json_slow(v) for v in list(value)]
         except Exception:
             pass
     return str(value)
 
 
-def _call_function_json(
+def _to_plain_json_bytes(value: Any) -> bytes:
+    try:
+        return orjson.dumps(value, default=_orjson_default, option=_ORJSON_OPTIONS)
+    except (orjson.JSONEncodeError, TypeError):
+        # Oversized ints, unsupported key types or very deep nesting: take the pure-Python walk.
+        return json.dumps(_to_plain_json_slow(value), ensure_ascii=False).encode("utf-8")
+
+
+def _to_json_text(value: Any) -> str:
+    return _to_plain_json_bytes(value).decode("utf-8")
+
+
+def _to_plain_json(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return orjson.loads(_to_plain_json_bytes(value))
+
+
+# Exact-match cache for deterministic function-calling prompts. Only _acall_function_json touches it,
+# always on the event loop, so like SESSION_STORE it needs no lock.
+GEMINI_RESPONSE_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=max(1, GEMINI_RESPONSE_CACHE_TTL_SECONDS))
+
+
+def _response_cache_key(model_name: str, function_name: str, prompt: str, parameters_schema: Dict[str, Any]) -> str:
+    schema = json.dumps(parameters_schema, sort_keys=True, ensure_ascii=False)
+    return _sha256_hex(f"{model_name}|{function_name}|{schema}|{prompt}")
+
+
+def _get_cached_response(key: str) -> Optional[Dict[str, Any]]:
+    cached = GEMINI_RESPONSE_CACHE.get(key)
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+def _store_cached_response(key: Optional[str], payload: Dict[str, Any]) -> Dict[str, Any]:
+    if key:
+        GEMINI_RESPONSE_CACHE[key] = copy.deepcopy(payload)
+    return payload
+
+
+# Explicit Gemini context caches for large static prompt prefixes, keyed by content hash.
+# Values are (cache_name or None when creation failed, monotonic expiry).
+CONTEXT_CACHE_NAMES: Dict[str, Tuple[Optional[str], float]] = {}
+_CONTEXT_CACHE_LOCK = threading.Lock()
+# Bumps every cache key whenever the archetype definitions baked into static prefixes change.
+CONTEXT_CACHE_VERSION = hashlib.sha256(json.dumps(ARCHETYPE_CONFIGS, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def _get_context_cache_name(
     client: genai.Client,
     model_name: str,
-    prompt: str,
+    static_prefix: str,
+    tool: types.Tool,
+    tool_config: types.ToolConfig,
     function_name: str,
-    function_description: str,
     parameters_schema: Dict[str, Any],
-    fallback: Dict[str, Any],
-) -> Dict[str, Any]:
+) -> Optional[str]:
+    if not GEMINI_CONTEXT_CACHE_ENABLED or len(static_prefix) < GEMINI_CONTEXT_CACHE_MIN_CHARS:
+        return None
+    schema = json.dumps(parameters_schema, sort_keys=True, ensure_ascii=False)
+    key = _sha256_hex(f"{CONTEXT_CACHE_VERSION}|{model_name}|{function_name}|{schema}|{static_prefix}")
+    now = time.monotonic()
+    with _CONTEXT_CACHE_LOCK:
+        entry = CONTEXT_CACHE_NAMES.get(key)
+    if entry is not None and now < entry[1]:
+        return entry[0]
+    cache_name: Optional[str] = None
+    try:
+        cached = client.caches.create(
+            model=model_name,
+            config=types.CreateCachedContentConfig(
+                system_instruction=static_prefix,
+                tools=[tool],
+                tool_config=tool_config,
+                ttl=f"{GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
+            ),
+        )
+        cache_name = getattr(cached, "name", None)
+    except Exception:
+        logger.warning("Gemini context cache creation failed for %s; sending prefix inline.", function_name)
+    with _CONTEXT_CACHE_LOCK:
+        # Refresh a minute before the server-side TTL lapses; failures are not retried until then either.
+        CONTEXT_CACHE_NAMES[key] = (cache_name, now + GEMINI_CONTEXT_CACHE_TTL_SECONDS - 60)
+    return cache_name
+
+
+# Bounds in-flight Gemini requests per process so bursts queue here instead of saturating the
+# per-minute quota; retries back off with jitter and release the slot while they wait.
+_GEMINI_SEM = asyncio.Semaphore(GEMINI_MAX_INFLIGHT)
+
+
+def _is_gemini_overload(exc: BaseException) -> bool:
+    return isinstance(exc, genai_errors.APIError) and (exc.code == 429 or exc.code >= 500)
+
+
+def _is_retryable_gemini_error(exc: BaseException) -> bool:
+    return _is_gemini_overload(exc) or isinstance(exc, (TimeoutError, httpx.TimeoutException))
+
+
+def _gemini_retry_policy(predicate: Callable[[BaseException], bool]) -> Dict[str, Any]:
+    return {
+        "wait": wait_exponential_jitter(initial=1, max=10),
+        "stop": stop_after_attempt(GEMINI_RETRY_ATTEMPTS),
+        "retry": retry_if_exception(predicate),
+        "reraise": True,
+    }
+
+
+def _function_call_tool(
+    function_name: str, function_description: str, parameters_schema: Dict[str, Any]
+) -> Tuple[types.Tool, types.ToolConfig]:
     declaration = types.FunctionDeclaration(
         name=function_name,
         description=function_description,
         parameters=parameters_schema,
     )
     tool = types.Tool(function_declarations=[declaration])
-    config = types.GenerateContentConfig(
-        tools=[tool],
-        tool_config=types.ToolConfig(
-            function_calling_config=types.FunctionCallingConfig(
-                mode="ANY",
-                allowed_function_names=[function_name],
-            )
-        ),
+    tool_config = types.ToolConfig(
+        function_calling_config=types.FunctionCallingConfig(
+            mode="ANY",
+            allowed_function_names=[function_name],
+        )
     )
+    return tool, tool_config
 
-    response = None
+
+def _function_call_request(
+    prompt: str,
+    static_prefix: str,
+    tool: types.Tool,
+    tool_config: types.ToolConfig,
+    cache_name: Optional[str],
+) -> Tuple[str, types.GenerateContentConfig]:
+    if cache_name:
+        # Tools and the static prefix live in the cached content; only the dynamic tail is sent.
+        return prompt, types.GenerateContentConfig(cached_content=cache_name)
+    return f"{static_prefix}{prompt}", types.GenerateContentConfig(tools=[tool], tool_config=tool_config)
+
+
+def _function_call_result(
+    response: Any, function_name: str, fallback: Dict[str, Any], cache_key: Optional[str]
+) -> Dict[str, Any]:
+    if response is None:
+        return _to_plain_json(_safe_json_loads("", fallback))
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=config,
-        )
         calls = getattr(response, "function_calls", None) or []
         for call in calls:
             if getattr(call, "name", "") == function_name:
                 args = dict(getattr(call, "args", {}) or {})
                 if args:
-                    return _to_plain_json(args)
+                    return _store_cached_response(cache_key, _to_plain_json(args))
         for candidate in getattr(response, "candidates", []) or []:
             content = getattr(candidate, "content", None)
             if not content:
@@ -692,96 +1286,117 @@ def _call_function_json(
                 if call and getattr(call, "name", "") == function_name:
                     args = dict(getattr(call, "args", {}) or {})
                     if args:
-                        return _to_plain_json(args)
+                        return _store_cached_response(cache_key, _to_plain_json(args))
     except Exception:
         logger.exception("Gemini function-calling failed for %s", function_name)
 
     text = ""
-    if response is not None:
-        try:
-            for candidate in getattr(response, "candidates", []) or []:
-                content = getattr(candidate, "content", None)
-                if not content:
-                    continue
-                for part in getattr(content, "parts", []) or []:
-                    part_text = getattr(part, "text", None)
-                    if part_text:
-                        text += part_text
-            if not text:
-                logger.warning("No text/function call returned for %s; likely blocked. Using fallback.", function_name)
-        except Exception:
-            logger.warning("Unable to extract candidate text for %s; using fallback.", function_name)
+    try:
+        text = "".join(_iter_part_texts(response))
+        if not text:
+            logger.warning("No text/function call returned for %s; likely blocked. Using fallback.", function_name)
+    except Exception:
+        logger.warning("Unable to extract candidate text for %s; using fallback.", function_name)
     return _to_plain_json(_safe_json_loads(text, fallback))
 
 
+async def _acall_function_json(
+    client: genai.Client,
+    model_name: str,
+    prompt: str,
+    function_name: str,
+    function_description: str,
+    parameters_schema: Dict[str, Any],
+    fallback: Dict[str, Any],
+    cacheable: bool = False,
+    static_prefix: str = "",
+) -> Dict[str, Any]:
+    # Runs on the client's aio surface, so callers can gather independent calls without holding a
+    # worker thread per request.
+    cache_key = None
+    if cacheable and GEMINI_RESPONSE_CACHE_TTL_SECONDS > 0:
+        cache_key = _response_cache_key(model_name, function_name, f"{static_prefix}{prompt}", parameters_schema)
+        cached = _get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+
+    tool, tool_config = _function_call_tool(function_name, function_description, parameters_schema)
+    cache_name = None
+    if static_prefix:
+        cache_name = await asyncio.to_thread(
+            _get_context_cache_name, client, model_name, static_prefix, tool, tool_config, function_name, parameters_schema
+        )
+    contents, config = _function_call_request(prompt, static_prefix, tool, tool_config, cache_name)
+
+    response = None
+    try:
+        async for attempt in AsyncRetrying(**_gemini_retry_policy(_is_retryable_gemini_error)):
+            with attempt:
+                async with _GEMINI_SEM:
+                    response = await client.aio.models.generate_content(
+                        model=model_name,
+                        contents=contents,
+                        config=config,
+                    )
+    except Exception:
+        logger.exception("Gemini function-calling failed for %s", function_name)
+    return _function_call_result(response, function_name, fallback, cache_key)
+
+
 def sanitize_text(text: str) -> str:
-    text = text.encode("ascii", "ignore").decode("ascii")
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
+    # The ASCII codec strip is already a single C pass; str.split() collapses the same whitespace
+    # as \s+ for ASCII text and is several times faster than re.sub on large scraped pages.
+    return " ".join(text.encode("ascii", "ignore").decode("ascii").split())
+
+
+# One alternation per caller so each text is scanned once. Where readings overlap on the same digits
+# ("₹150 lakh", "50000 l"), the leftmost match wins and lakh is tried before bare numbers.
+_LAKH_PART = r"(?:(?:\u20b9|inr|rs\.?)\s*)?(?P<lakh>\d+(?:\.\d+)?)\s*(?:lakh|l\b)"
+_FEE_AMOUNT_RE = re.compile(
+    _LAKH_PART
+    + r"|(?:\u20b9|inr|rs\.?)\s*(?P<inr>[0-9][0-9,]{3,10})"
+    + r"|\b(?P<generic>[0-9][0-9,]{3,10})\b"
+)
+_OFFER_AMOUNT_RE = re.compile(
+    _LAKH_PART
+    + r"|(?:\u20b9|inr|rs\.?)\s*(?P<inr>[0-9][0-9,]{2,10})"
+    + r"|\$(?P<usd>[0-9][0-9,]{2,10})"
+    + r"|\b(?P<generic>[1-9][0-9,]{4,10})\b"
+)
 
 
 def extract_inr_amount(text: str) -> int:
     raw = (text or "").lower()
-    
-    # Check for Lakhs/L
-    lakh_matches = re.findall(r"(\d+(?:\.\d+)?)\s*(?:lakh|l\b)", raw)
-    if lakh_matches:
-        values = [int(float(v) * 100_000) for v in lakh_matches]
-        return max(1000, max(values))
-
-    currency_matches = re.findall(
-        r"(?:\u20b9|inr|rs\.?)\s*([0-9][0-9,]{3,10})",
-        raw,
-        flags=re.IGNORECASE,
-    )
-    if currency_matches:
-        values = [int(v.replace(",", "")) for v in currency_matches]
-        return max(1000, max(values))
-
-    generic_matches = re.findall(r"\b([0-9][0-9,]{3,10})\b", raw)
-    if generic_matches:
-        values = [int(v.replace(",", "")) for v in generic_matches]
-        return max(1000, max(values))
+    # Priority is lakh > currency-prefixed > bare number; keep the largest value seen for each kind.
+    best: Dict[str, int] = {}
+    for match in _FEE_AMOUNT_RE.finditer(raw):
+        kind = match.lastgroup or ""
+        value = match.group(kind)
+        amount = int(float(value) * 100_000) if kind == "lakh" else int(value.replace(",", ""))
+        if amount > best.get(kind, -1):
+            best[kind] = amount
+    for kind in ("lakh", "inr", "generic"):
+        if kind in best:
+            return max(1000, best[kind])
     return 4500
 
 
-def _extract_all_offer_candidates(text: str) -> List[int]:
-    raw = (text or "").lower()
+def _extract_all_offer_candidates_lc(text_lc: str) -> List[int]:
+    # Expects text already lowercased by the caller (_update_metrics lowercases each message once).
     candidates = []
-    
-    # 1. Handle Lakhs/L
-    lakh_matches = re.findall(r"(\d+(?:\.\d+)?)\s*(?:lakh|l\b)", raw)
-    for m in lakh_matches:
-        try:
-            candidates.append(int(float(m) * 100_000))
-        except ValueError:
-            pass
-
-    # 2. INR prefix
-    inr_matches = re.findall(r"(?:\u20b9|inr|rs\.?)\s*([0-9][0-9,]{2,10})", raw)
-    for m in inr_matches:
-        try:
-            candidates.append(int(m.replace(",", "")))
-        except ValueError:
-            pass
-
-    # 3. Generic large numbers
-    generic_matches = re.findall(r"\b([1-9][0-9,]{4,10})\b", raw)
-    for m in generic_matches:
-        try:
-            val = int(m.replace(",", ""))
-            if val > 5000:
-                candidates.append(val)
-        except ValueError:
-            pass
-
-    usd_matches = re.findall(r"\$([0-9][0-9,]{2,10})", raw)
-    for m in usd_matches:
+    for match in _OFFER_AMOUNT_RE.finditer(text_lc):
+        kind = match.lastgroup or ""
+        value = match.group(kind)
         try:
-            candidates.append(int(m.replace(",", "")))
+            if kind == "lakh":
+                candidates.append(int(float(value) * 100_000))
+                continue
+            amount = int(value.replace(",", ""))
         except ValueError:
-            pass
-
+            continue
+        # Bare numbers only count as offers when they are large enough to be a fee.
+        if kind != "generic" or amount > 5000:
+            candidates.append(amount)
     return candidates
 
 
@@ -805,46 +1420,174 @@ def _derive_financials(program: Dict[str, Any], persona: Dict[str, Any]) -> Dict
     }
 
 
-def extract_from_url(url: str) -> str:
+_SCRAPE_NOISE_TAGS = ("script", "style", "nav", "footer", "svg", "header")
+
+
+def _html_to_text(html: str) -> str:
+    # Prefer the C-backed lexbor parser; BeautifulSoup stays as the pure-Python fallback.
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html)
+        for node in tree.css(",".join(_SCRAPE_NOISE_TAGS)):
+            node.decompose()
+        return tree.root.text(separator=" ") if tree.root is not None else ""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(list(_SCRAPE_NOISE_TAGS)):
+        tag.decompose()
+    return soup.get_text(separator=" ")
+
+
+async def _fetch_capped_text(http: httpx.AsyncClient, url: str, timeout: float, raise_for_status: bool = False) -> Tuple[int, str]:
+    # Stream the body and stop at SCRAPE_MAX_BYTES; decode with the declared charset only (no detection).
+    async with http.stream("GET", url, timeout=timeout) as response:
+        if raise_for_status:
+            response.raise_for_status()
+        body = bytearray()
+        async for chunk in response.aiter_bytes(65536):
+            body.extend(chunk)
+            if len(body) >= SCRAPE_MAX_BYTES:
+                del body[SCRAPE_MAX_BYTES:]
+                break
+        encoding = response.charset_encoding or "utf-8"
+        try:
+            text = body.decode(encoding, errors="ignore")
+        except LookupError:
+            text = body.decode("utf-8", errors="ignore")
+        return response.status_code, text
+
+
+async def extract_from_url(url: str) -> str:
     """
     Scrapes text from a URL. Uses Jina Reader as a primary method for better LLM formatting.
     """
+    http = get_http_client()
     # Try Jina Reader first
     try:
         jina_url = f"https://r.jina.ai/{url}"
-        response = requests.get(jina_url, timeout=20, headers={"User-Agent": "Mozilla/5.0"})
-        if response.status_code == 200 and len(response.text.strip()) > 200:
-            return sanitize_text(response.text)
+        status_code, text = await _fetch_capped_text(http, jina_url, timeout=20)
+        if status_code == 200 and len(text.strip()) > 200:
+            return sanitize_text(text)
     except Exception as exc:
         logger.warning("Jina Reader failed for %s: %s. Falling back to direct scraping.", url, str(exc))
 
-    # Fallback to direct requests
+    # Fallback to direct fetch over the same pooled client
     try:
-        response = requests.get(url, timeout=15, headers={"User-Agent": "Mozilla/5.0"})
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        for tag in soup(["script", "style", "nav", "footer", "svg", "header"]):
-            tag.decompose()
-        text = soup.get_text(separator=" ")
-        return sanitize_text(text)
+        _, html = await _fetch_capped_text(http, url, timeout=15, raise_for_status=True)
+        return sanitize_text(_html_to_text(html))
     except Exception as exc:
         logger.error("Scraping fully failed for %s: %s", url, str(exc))
         return f"Error extracting from URL: {str(exc)}"
 
 
+# Extracted page text per URL, so re-analysing a URL (retries, other archetypes) skips the scrape.
+# Only touched from the event loop; failed extractions are not cached.
+URL_CONTENT_CACHE: TTLCache = TTLCache(maxsize=128, ttl=max(1, URL_CONTENT_CACHE_TTL_SECONDS))
+
+
+async def _cached_extract_from_url(url: str) -> str:
+    cached = URL_CONTENT_CACHE.get(url)
+    if cached is not None:
+        return cached
+    text = (await extract_from_url(url))[:PROGRAM_CONTENT_MAX_CHARS]
+    if URL_CONTENT_CACHE_TTL_SECONDS > 0 and not text.startswith("Error extracting from URL:"):
+        URL_CONTENT_CACHE[url] = text
+    return text
+
+
+# Response-parsing patterns are compiled once here; these run several times on every model turn.
+_CONTROL_LABELS = r"(?:INTERNAL_THOUGHT|UPDATED_STATS|UPDATED_STATE|EMOTIONAL_STATE|STRATEGIC_INTENT|TECHNIQUES_USED|CONFIDENCE_SCORE)"
+_RESPONSE_TAGS = (
+    "message",
+    "thought",
+    "intent",
+    "stats",
+    "techniques",
+    "confidence",
+    "confidence_score",
+    "emotional_state",
+    "emotion",
+)
+
+
+# Python's \s, spelled out for RE2 (whose \s is ASCII-only and omits \v).
+_RE2_WHITESPACE_CLASS = r"[\t\n\v\f\r\x1c-\x1f\x85\p{Z}]"
+
+
+def _compile_linear(pattern: str) -> Any:
+    # Case-insensitive, dot-all parsing pattern, compiled with RE2 when installed. Lazy `.*?` blocks
+    # backtrack quadratically in `re` on malformed output (e.g. thousands of unclosed tags); RE2 is
+    # linear. Patterns must avoid backreferences, lookaround and \b, and keep \s outside [...].
+    if re2 is not None:
+        return re2.compile("(?is)" + pattern.replace(r"\s", _RE2_WHITESPACE_CLASS))
+    return re.compile(pattern, re.IGNORECASE | re.DOTALL)
+
+
+def _compile_tag_block_patterns(tag: str) -> Tuple[Any, Any]:
+    return (
+        _compile_linear(rf"<{tag}>\s*(.*?)\s*</{tag}>"),
+        _compile_linear(rf"<{tag}>\s*(.*)$"),
+    )
+
+
+# tag -> (closed block, open-only fallback)
+_TAG_BLOCK_RES: Dict[str, Tuple[Any, Any]] = {tag: _compile_tag_block_patterns(tag) for tag in _RESPONSE_TAGS}
+# (label, stop labels) -> pattern; filled on first use since the call sites pass fixed label sets.
+_LABELED_BLOCK_RES: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+_MESSAGE_BLOCK_RE = _compile_linear(rf"MESSAGE:\s*(.*?)(?:(?:\n|\r|\s){_CONTROL_LABELS}\s*:|$)")
+_MESSAGE_LABEL_TAIL_RE = _compile_linear(rf"{_CONTROL_LABELS}\s*:.*$")
+_TECHNIQUES_USED_RE = _compile_linear(r"TECHNIQUES_USED:\s*\[(.*?)\]")
+_CONFIDENCE_SCORE_RE = re.compile(r"CONFIDENCE_SCORE:\s*([0-9]+(?:\.[0-9]+)?)", re.IGNORECASE)
+_EMOTIONAL_STATE_RE = re.compile(r"EMOTIONAL_STATE:\s*([a-zA-Z_ -]+)", re.IGNORECASE)
+# Strips every non-message tag block in one left-to-right pass.
+_RESPONSE_SCRUB_RE = _compile_linear(
+    r"<thought>.*?</thought>"
+    r"|<stats>.*?</stats>"
+    r"|<intent>.*?</intent>"
+    r"|<emotional_state>.*?</emotional_state>"
+    r"|<emotion>.*?</emotion>"
+    r"|<techniques>.*?</techniques>"
+    r"|<confidence(?:_score)?>.*?</confidence(?:_score)?>"
+)
+_SPACE_BEFORE_NEWLINE_RE = re.compile(r"\s+\n")
+
+
+def _collapse_trailing_ws(text: str) -> str:
+    # The regex also folds blank-line runs into one newline, so only single-line text skips it.
+    if "\n" not in text:
+        return text.strip()
+    return _SPACE_BEFORE_NEWLINE_RE.sub("\n", text).strip()
+
+
 def _extract_labeled_block(raw: str, label: str, stop_labels: List[str]) -> str:
-    stop_pattern = "|".join(re.escape(item) for item in stop_labels)
-    pattern = rf"{re.escape(label)}:\s*(.*?)(?:\n(?:{stop_pattern})\s*:|$)"
-    match = re.search(pattern, raw, flags=re.IGNORECASE | re.DOTALL)
+    key = (label, tuple(stop_labels))
+    pattern = _LABELED_BLOCK_RES.get(key)
+    if pattern is None:
+        stop_pattern = "|".join(re.escape(item) for item in stop_labels)
+        pattern = _compile_linear(rf"{re.escape(label)}:\s*(.*?)(?:\n(?:{stop_pattern})\s*:|$)")
+        _LABELED_BLOCK_RES[key] = pattern
+    match = pattern.search(raw)
     return match.group(1).strip() if match else ""
 
 
-def _extract_tag_block(raw: str, tag: str) -> str:
-    closed = re.search(rf"<{tag}>\s*(.*?)\s*</{tag}>", raw, flags=re.IGNORECASE | re.DOTALL)
+def _extract_tag_block(raw: str, tag: str, lowered: Optional[str] = None) -> str:
+    if lowered is not None:
+        # ASCII fast path: `lowered` is raw.lower() with identical offsets, so plain find() reproduces
+        # the closed-then-open-only regex results without re-scanning per pattern.
+        open_tag = f"<{tag}>"
+        start = lowered.find(open_tag)
+        if start == -1:
+            return ""
+        start += len(open_tag)
+        end = lowered.find(f"</{tag}>", start)
+        return (raw[start:end] if end != -1 else raw[start:]).strip()
+    patterns = _TAG_BLOCK_RES.get(tag)
+    if patterns is None:
+        patterns = _TAG_BLOCK_RES[tag] = _compile_tag_block_patterns(tag)
+    closed_re, open_only_re = patterns
+    closed = closed_re.search(raw)
     if closed:
         return closed.group(1).strip()
     # Fallback when model forgets closing tag.
-    open_only = re.search(rf"<{tag}>\s*(.*)$", raw, flags=re.IGNORECASE | re.DOTALL)
+    open_only = open_only_re.search(raw)
     if open_only:
         return open_only.group(1).strip()
     return ""
@@ -852,20 +1595,11 @@ def _extract_tag_block(raw: str, tag: str) -> str:
 
 def _extract_message_block(raw: str) -> str:
     # Handles both multi-line and single-line labeled output where control labels may be inline.
-    pattern = (
-        r"MESSAGE:\s*(.*?)(?:(?:\n|\r|\s)"
-        r"(?:INTERNAL_THOUGHT|UPDATED_STATS|UPDATED_STATE|EMOTIONAL_STATE|STRATEGIC_INTENT|TECHNIQUES_USED|CONFIDENCE_SCORE)\s*:|$)"
-    )
-    match = re.search(pattern, raw, flags=re.IGNORECASE | re.DOTALL)
+    match = _MESSAGE_BLOCK_RE.search(raw)
     if not match:
         return ""
     message = match.group(1).strip()
-    message = re.sub(
-        r"(?:INTERNAL_THOUGHT|UPDATED_STATS|UPDATED_STATE|EMOTIONAL_STATE|STRATEGIC_INTENT|TECHNIQUES_USED|CONFIDENCE_SCORE)\s*:.*$",
-        "",
-        message,
-        flags=re.IGNORECASE | re.DOTALL,
-    ).strip()
+    message = _MESSAGE_LABEL_TAIL_RE.sub("", message).strip()
     return message
 
 
@@ -874,39 +1608,42 @@ def _extract_first_json_object(raw: str) -> Dict[str, Any]:
     end = raw.rfind("}")
     if start == -1 or end == -1 or end <= start:
         return {}
-    try:
-        parsed = json.loads(raw[start : end + 1])
-    except Exception:
+    if end - start > EMBEDDED_JSON_MAX_CHARS:
         return {}
+    candidate = raw[start : end + 1]
+    try:
+        parsed = orjson.loads(candidate)
+    except orjson.JSONDecodeError:
+        # orjson is stricter (NaN/Infinity, big ints, lone surrogates); keep json's leniency.
+        try:
+            parsed = json.loads(candidate)
+        except Exception:
+            return {}
     if isinstance(parsed, dict):
         return parsed
     return {}
 
 
+_LABEL_LINE_RE = re.compile(
+    r"(?:INTERNAL_THOUGHT|UPDATED_STATS|UPDATED_STATE|MESSAGE|EMOTIONAL_STATE|STRATEGIC_INTENT|TECHNIQUES_USED|CONFIDENCE_SCORE):",
+    re.IGNORECASE,
+)
+
+
 def _extract_unlabeled_message(raw: str) -> str:
-    lines = [line.strip() for line in (raw or "").splitlines() if line.strip()]
-    if not lines:
-        return ""
-    label_prefixes = (
-        "INTERNAL_THOUGHT:",
-        "UPDATED_STATS:",
-        "UPDATED_STATE:",
-        "MESSAGE:",
-        "EMOTIONAL_STATE:",
-        "STRATEGIC_INTENT:",
-        "TECHNIQUES_USED:",
-        "CONFIDENCE_SCORE:",
-    )
-    cleaned = [line for line in lines if not line.upper().startswith(label_prefixes)]
+    stripped = (line.strip() for line in (raw or "").splitlines())
+    cleaned = [line for line in stripped if line and not _LABEL_LINE_RE.match(line)]
     return " ".join(cleaned).strip()
 
 
 def _clamp_score(value: Any, fallback: int = 50) -> int:
-    try:
-        parsed = int(float(value))
-    except Exception:
-        parsed = fallback
-    return max(0, min(100, parsed))
+    # Plain ints (the usual case) skip the float round trip and exception setup.
+    if type(value) is not int:
+        try:
+            value = int(float(value))
+        except Exception:
+            value = fallback
+    return 0 if value < 0 else 100 if value > 100 else value
 
 
 def _merge_student_inner_state(current: StudentInnerState, updates: Dict[str, Any]) -> StudentInnerState:
@@ -933,76 +1670,255 @@ def _merge_student_inner_state(current: StudentInnerState, updates: Dict[str, An
     return merged
 
 
-def _extract_chunk_text(chunk: Any) -> str:
-    text = getattr(chunk, "text", None)
-    if isinstance(text, str) and text.strip():
-        return text
-
-    fragments: List[str] = []
-    for candidate in getattr(chunk, "candidates", []) or []:
+def _iter_part_texts(response: Any) -> Iterator[str]:
+    for candidate in getattr(response, "candidates", None) or ():
         content = getattr(candidate, "content", None)
         if not content:
             continue
-        for part in getattr(content, "parts", []) or []:
+        for part in getattr(content, "parts", None) or ():
             part_text = getattr(part, "text", None)
             if part_text:
-                fragments.append(part_text)
-    return "".join(fragments)
+                yield part_text
+
+
+def _extract_chunk_text(chunk: Any) -> str:
+    text = getattr(chunk, "text", None)
+    if isinstance(text, str) and text.strip():
+        return text
+    return "".join(_iter_part_texts(chunk))
 
 
 def _extract_response_text_from_non_stream(response: Any) -> str:
-    parts: List[str] = []
     direct_text = getattr(response, "text", None)
+    part_texts = "".join(_iter_part_texts(response))
     if isinstance(direct_text, str) and direct_text.strip():
-        parts.append(direct_text)
-    for candidate in getattr(response, "candidates", []) or []:
-        content = getattr(candidate, "content", None)
-        if not content:
-            continue
-        for part in getattr(content, "parts", []) or []:
-            part_text = getattr(part, "text", None)
-            if part_text:
-                parts.append(part_text)
-    return "".join(parts).strip()
+        return (direct_text + part_texts).strip()
+    return part_texts.strip()
+
+
+_RESPONSE_TAG_MARKERS = tuple(f"<{tag}>" for tag in _RESPONSE_TAGS)
+_RESPONSE_LABEL_MARKERS = (
+    "INTERNAL_THOUGHT:",
+    "STRATEGIC_INTENT:",
+    "UPDATED_STATS:",
+    "UPDATED_STATE:",
+    "EMOTIONAL_STATE:",
+    "CONFIDENCE_SCORE:",
+    "TECHNIQUES_USED:",
+    "MESSAGE:",
+)
+
+
+def _response_markers(lowered: Optional[str]) -> Optional[Set[str]]:
+    # Records which opening tags ("<thought>") and labels ("MESSAGE:") occur so the field extractors
+    # only run searches that can match. None (non-ASCII input) means "assume everything is present".
+    if lowered is None:
+        return None
+    markers = {marker for marker in _RESPONSE_TAG_MARKERS if marker in lowered}
+    markers.update(marker for marker in _RESPONSE_LABEL_MARKERS if marker.lower() in lowered)
+    return markers
+
+
+_RESPONSE_CLOSE_TAG_MARKERS = tuple(f"</{tag}>" for tag in _RESPONSE_TAGS)
+_RESPONSE_SCAN_LITERALS = _RESPONSE_TAG_MARKERS + _RESPONSE_CLOSE_TAG_MARKERS + _RESPONSE_LABEL_MARKERS
 
 
-def _extract_response_fields(text: str) -> Dict[str, Any]:
+def _build_response_marker_db(streaming: bool = False) -> Any:
+    if hyperscan is None:
+        return None
+    try:
+        database = hyperscan.Database(mode=hyperscan.HS_MODE_STREAM) if streaming else hyperscan.Database()
+        database.compile(
+            expressions=[re.escape(literal).encode("ascii") for literal in _RESPONSE_SCAN_LITERALS],
+            ids=list(range(len(_RESPONSE_SCAN_LITERALS))),
+            flags=[hyperscan.HS_FLAG_CASELESS] * len(_RESPONSE_SCAN_LITERALS),
+        )
+        return database
+    except Exception:
+        logger.exception("Failed to build Hyperscan marker database; using substring scans")
+        return None
+
+
+# Multi-literal Hyperscan database: one pass yields the offset of every tag and label occurrence.
+_RESPONSE_MARKER_DB = _build_response_marker_db()
+# Same literals in streaming mode, fed chunk by chunk while a model response streams in.
+_RESPONSE_MARKER_STREAM_DB = _build_response_marker_db(streaming=True)
+# Hyperscan scratch space is not thread-safe; parsing can run on worker threads.
+_RESPONSE_MARKER_SCRATCH = threading.local()
+
+
+def _scan_response_markers(raw: str) -> Optional[Dict[str, List[int]]]:
+    # ASCII text only, so byte offsets equal string offsets. Returns marker -> ascending start offsets.
+    if _RESPONSE_MARKER_DB is None:
+        return None
+    scratch = getattr(_RESPONSE_MARKER_SCRATCH, "scratch", None)
+    if scratch is None:
+        scratch = _RESPONSE_MARKER_SCRATCH.scratch = hyperscan.Scratch(_RESPONSE_MARKER_DB)
+    positions: Dict[str, List[int]] = {}
+
+    def on_match(literal_id: int, start: int, end: int, flags: int, context: Any) -> None:
+        literal = _RESPONSE_SCAN_LITERALS[literal_id]
+        positions.setdefault(literal, []).append(end - len(literal))
+
+    _RESPONSE_MARKER_DB.scan(raw.encode("ascii"), match_event_handler=on_match, scratch=scratch)
+    return positions
+
+
+class _ResponseMarkerStream:
+    """Incrementally indexes response markers as streamed text arrives, so the final parse skips the rescan."""
+
+    def __init__(self) -> None:
+        self.positions: Optional[Dict[str, List[int]]] = None
+        self.message_closed = False
+        self._stream: Any = None
+        if _RESPONSE_MARKER_STREAM_DB is None:
+            return
+        # The binding does not keep the handler alive, so the bound method is held for the stream's lifetime.
+        self._handler = self._on_match
+        try:
+            stream = _RESPONSE_MARKER_STREAM_DB.stream(match_event_handler=self._handler)
+            stream.__enter__()
+        except Exception:
+            logger.debug("Failed to open Hyperscan marker stream", exc_info=True)
+            return
+        self._stream = stream
+        self.positions = {}
+
+    def _on_match(self, literal_id: int, start: int, end: int, flags: int, context: Any) -> None:
+        literal = _RESPONSE_SCAN_LITERALS[literal_id]
+        self.positions.setdefault(literal, []).append(end - len(literal))
+        if literal == "</message>":
+            self.message_closed = True
+
+    def feed(self, text: str) -> None:
+        if self._stream is None:
+            return
+        # Offsets are byte offsets; they only match string offsets while every chunk is ASCII.
+        if not text.isascii():
+            self._abandon()
+            return
+        scratch = getattr(_RESPONSE_MARKER_SCRATCH, "stream_scratch", None)
+        try:
+            if scratch is None:
+                scratch = _RESPONSE_MARKER_SCRATCH.stream_scratch = hyperscan.Scratch(_RESPONSE_MARKER_STREAM_DB)
+            self._stream.scan(text.encode("ascii"), scratch=scratch)
+        except Exception:
+            logger.debug("Hyperscan marker stream failed; falling back to a full scan", exc_info=True)
+            self._abandon()
+
+    def close(self) -> None:
+        # Closing twice crashes the binding, so the handle is dropped before it is closed.
+        stream, self._stream = self._stream, None
+        if stream is None:
+            return
+        try:
+            stream.__exit__(None, None, None)
+        except Exception:
+            logger.debug("Failed to close Hyperscan marker stream", exc_info=True)
+
+    def _abandon(self) -> None:
+        self.close()
+        self.positions = None
+
+
+def _slice_tag_block(raw: str, tag: str, positions: Dict[str, List[int]]) -> str:
+    # Same result as the closed-then-open-only tag regexes: first opening tag, first closing tag after it.
+    opens = positions.get(f"<{tag}>")
+    if not opens:
+        return ""
+    start = opens[0] + len(tag) + 2
+    for close in positions.get(f"</{tag}>", ()):
+        if close >= start:
+            return raw[start:close].strip()
+    return raw[start:].strip()
+
+
+# Tails matched right after a literal label found by offset, instead of searching the whole response.
+_TECHNIQUES_USED_TAIL_RE = re.compile(r"\s*\[(.*?)\]", re.DOTALL)
+_CONFIDENCE_SCORE_TAIL_RE = re.compile(r"\s*([0-9]+(?:\.[0-9]+)?)")
+_EMOTIONAL_STATE_TAIL_RE = re.compile(r"\s*([a-zA-Z_ -]+)")
+
+
+def _marker_offsets(marker: str, positions: Optional[Dict[str, List[int]]], lowered: Optional[str]) -> Iterator[int]:
+    if positions is not None:
+        yield from positions.get(marker, ())
+        return
+    if lowered is None:
+        return
+    needle = marker.lower()
+    offset = lowered.find(needle)
+    while offset != -1:
+        yield offset
+        offset = lowered.find(needle, offset + 1)
+
+
+def _extract_response_fields(text: str, marker_positions: Optional[Dict[str, List[int]]] = None) -> Dict[str, Any]:
     raw = text or ""
+    # re.IGNORECASE folds a few non-ASCII characters that lower() does not, so only ASCII text takes
+    # the marker-index fast paths (Hyperscan when installed, otherwise a lowercase copy).
+    # marker_positions, when given, must index exactly this text (see _ResponseMarkerStream).
+    is_ascii = raw.isascii()
+    if not is_ascii:
+        positions = None
+    elif marker_positions is not None:
+        positions = marker_positions
+    else:
+        positions = _scan_response_markers(raw)
+    lowered = raw.lower() if is_ascii and positions is None else None
+    markers = set(positions) if positions is not None else _response_markers(lowered)
+
+    def has(marker: str) -> bool:
+        return markers is None or marker in markers
+
+    def tag_block(tag: str) -> str:
+        if not has(f"<{tag}>"):
+            return ""
+        if positions is not None:
+            return _slice_tag_block(raw, tag, positions)
+        return _extract_tag_block(raw, tag, lowered)
+
+    def labeled_block(label: str, stop_labels: List[str]) -> str:
+        return _extract_labeled_block(raw, label, stop_labels) if has(f"{label}:") else ""
+
+    def label_value(label: str, tail_re: re.Pattern, search_re: Any) -> Optional[str]:
+        if not has(label):
+            return None
+        if markers is None:
+            match = search_re.search(raw)
+            return match.group(1) if match else None
+        for offset in _marker_offsets(label, positions, lowered):
+            match = tail_re.match(raw, offset + len(label))
+            if match:
+                return match.group(1)
+        return None
+
     techniques: List[str] = []
-    message = _extract_tag_block(raw, "message") or _extract_message_block(raw)
-    thought = _extract_tag_block(raw, "thought") or _extract_labeled_block(
-        raw,
+    message = tag_block("message") or (_extract_message_block(raw) if has("MESSAGE:") else "")
+    thought = tag_block("thought") or labeled_block(
         "INTERNAL_THOUGHT",
         ["UPDATED_STATS", "UPDATED_STATE", "MESSAGE", "STRATEGIC_INTENT", "EMOTIONAL_STATE"],
     )
-    intent = _extract_tag_block(raw, "intent") or _extract_labeled_block(
-        raw,
+    intent = tag_block("intent") or labeled_block(
         "STRATEGIC_INTENT",
         ["MESSAGE", "EMOTIONAL_STATE", "CONFIDENCE_SCORE"],
     )
-    emotional_state = (
-        _extract_tag_block(raw, "emotional_state")
-        or _extract_tag_block(raw, "emotion")
-        or "calm"
-    )
+    emotional_state = tag_block("emotional_state") or tag_block("emotion") or "calm"
     confidence = 60
 
-    updated_stats_raw = _extract_tag_block(raw, "stats")
+    updated_stats_raw = tag_block("stats")
     if not updated_stats_raw:
-        updated_stats_raw = _extract_labeled_block(
-            raw,
+        updated_stats_raw = labeled_block(
             "UPDATED_STATS",
             ["MESSAGE", "STRATEGIC_INTENT", "EMOTIONAL_STATE", "INTERNAL_THOUGHT", "UPDATED_STATE"],
         )
     if not updated_stats_raw:
-        updated_stats_raw = _extract_labeled_block(
-            raw,
+        updated_stats_raw = labeled_block(
             "UPDATED_STATE",
             ["MESSAGE", "STRATEGIC_INTENT", "EMOTIONAL_STATE", "INTERNAL_THOUGHT", "UPDATED_STATS"],
         )
     updated_stats = _extract_first_json_object(updated_stats_raw)
 
-    techniques_raw = _extract_tag_block(raw, "techniques")
+    techniques_raw = tag_block("techniques")
     if techniques_raw:
         parsed_techniques = _extract_first_json_object(f"{{\"items\": {techniques_raw}}}").get("items", [])
         if isinstance(parsed_techniques, list):
@@ -1010,44 +1926,38 @@ def _extract_response_fields(text: str) -> Dict[str, Any]:
         elif not techniques:
             techniques = [item.strip() for item in techniques_raw.split(",") if item.strip()]
     if not techniques:
-        techniques_match = re.search(r"TECHNIQUES_USED:\s*\[(.*?)\]", raw, flags=re.IGNORECASE | re.DOTALL)
-        if techniques_match:
+        techniques_list = label_value("TECHNIQUES_USED:", _TECHNIQUES_USED_TAIL_RE, _TECHNIQUES_USED_RE)
+        if techniques_list is not None:
             techniques = [
                 item.strip().strip('"').strip("'")
-                for item in techniques_match.group(1).split(",")
+                for item in techniques_list.split(",")
                 if item.strip()
             ]
 
-    confidence_raw = _extract_tag_block(raw, "confidence") or _extract_tag_block(raw, "confidence_score")
+    confidence_raw = tag_block("confidence") or tag_block("confidence_score")
     if confidence_raw:
         confidence = _clamp_score(confidence_raw, 60)
     else:
-        confidence_match = re.search(r"CONFIDENCE_SCORE:\s*([0-9]+(?:\.[0-9]+)?)", raw, flags=re.IGNORECASE)
-        if confidence_match:
+        confidence_value = label_value("CONFIDENCE_SCORE:", _CONFIDENCE_SCORE_TAIL_RE, _CONFIDENCE_SCORE_RE)
+        if confidence_value is not None:
             try:
-                confidence = int(float(confidence_match.group(1)))
+                confidence = int(float(confidence_value))
             except Exception:
                 confidence = 60
 
     if emotional_state == "calm":
-        emotional_match = re.search(r"EMOTIONAL_STATE:\s*([a-zA-Z_ -]+)", raw, flags=re.IGNORECASE)
-        if emotional_match:
-            emotional_state = emotional_match.group(1).strip().lower()
+        emotional_value = label_value("EMOTIONAL_STATE:", _EMOTIONAL_STATE_TAIL_RE, _EMOTIONAL_STATE_RE)
+        if emotional_value is not None:
+            emotional_state = emotional_value.strip().lower()
 
     if not message:
-        clean_text = re.sub(r"<thought>.*?</thought>", " ", raw, flags=re.IGNORECASE | re.DOTALL)
-        clean_text = re.sub(r"<stats>.*?</stats>", " ", clean_text, flags=re.IGNORECASE | re.DOTALL)
-        clean_text = re.sub(r"<intent>.*?</intent>", " ", clean_text, flags=re.IGNORECASE | re.DOTALL)
-        clean_text = re.sub(r"<emotional_state>.*?</emotional_state>", " ", clean_text, flags=re.IGNORECASE | re.DOTALL)
-        clean_text = re.sub(r"<emotion>.*?</emotion>", " ", clean_text, flags=re.IGNORECASE | re.DOTALL)
-        clean_text = re.sub(r"<techniques>.*?</techniques>", " ", clean_text, flags=re.IGNORECASE | re.DOTALL)
-        clean_text = re.sub(r"<confidence(?:_score)?>.*?</confidence(?:_score)?>", " ", clean_text, flags=re.IGNORECASE | re.DOTALL)
+        clean_text = _RESPONSE_SCRUB_RE.sub(" ", raw)
         clean_text = clean_text.replace("<message>", " ").replace("</message>", " ")
         message = _extract_unlabeled_message(clean_text)
     if not message:
         message = "..."
 
-    message = re.sub(r"\s+\n", "\n", message).strip()
+    message = _collapse_trailing_ws(message)
     return {
         "message": message,
         "techniques": techniques,
@@ -1065,53 +1975,173 @@ def _extract_counsellor_message(text: str) -> str:
         return "..."
     tagged = _extract_tag_block(raw, "message")
     if tagged:
-        return re.sub(r"\s+\n", "\n", tagged).strip() or "..."
-    return re.sub(r"\s+\n", "\n", raw).strip() or "..."
+        return _collapse_trailing_ws(tagged) or "..."
+    return _collapse_trailing_ws(raw) or "..."
+
+
+def _fields_from_retry_payload(retry_payload: Dict[str, Any], agent: str) -> Dict[str, Any]:
+    # Same fields _extract_response_fields would recover from the framed retry text. The counsellor
+    # retry only ever contributed its message.
+    message = str(retry_payload.get("message", "")).strip()
+    if not message:
+        message = (
+            "I am still evaluating this. Please share your top concern so I can respond precisely."
+            if agent == "student"
+            else "Could you share your top concern so I can address it directly?"
+        )
+    fields: Dict[str, Any] = {
+        "message": _collapse_trailing_ws(message),
+        "techniques": [],
+        "intent": "",
+        "confidence_score": 60,
+        "emotional_state": "calm",
+        "internal_thought": "",
+        "updated_stats": {},
+    }
+    if agent == "student":
+        updated_stats = retry_payload.get("updated_stats", {})
+        fields["intent"] = str(retry_payload.get("intent", "")).strip() or "No Intent detected"
+        fields["emotional_state"] = str(retry_payload.get("emotional_state", "")).strip() or "calm"
+        fields["internal_thought"] = str(retry_payload.get("internal_thought", "")).strip() or "No internal thought captured"
+        fields["updated_stats"] = updated_stats if isinstance(updated_stats, dict) else {}
+    return fields
 
 
 def _trim_messages(messages: List[Dict[str, Any]], max_messages: int = 12) -> List[Dict[str, Any]]:
     return messages[-max_messages:]
 
 
+def _format_recent_transcript(messages: List[Dict[str, Any]], max_messages: int) -> str:
+    # Negative slicing copies only the last max_messages references; islice would step over the whole head.
+    return "\n".join(_transcript_line(m) for m in _trim_messages(messages, max_messages))
+
+
+def _transcript_line(message: Dict[str, Any]) -> str:
+    return f"{message['agent'].upper()}: {message['content']}"
+
+
+def _judge_transcript_line(message: Dict[str, Any]) -> str:
+    return f"Round {message['round']} {message['agent'].upper()}: {message['content']}"
+
+
+TRANSCRIPT_TAIL_MAX_LINES = 12
+
+
+def _append_turn(state: NegotiationState, message: Dict[str, Any], report_message: Dict[str, Any]) -> None:
+    state["messages"].append(message)
+    state["history_for_reporting"].append(report_message)
+    tail = state.get("transcript_tail")
+    if tail is not None:
+        tail.append(_transcript_line(message))
+    judge_lines = state.get("judge_transcript_lines")
+    if judge_lines is not None:
+        judge_lines.append(_judge_transcript_line(message))
+
+
+def _recent_transcript(state: NegotiationState, max_messages: int) -> str:
+    # Prompt builders read preformatted lines kept by _append_turn; states built elsewhere fall back to messages.
+    tail = state.get("transcript_tail")
+    if tail is None or max_messages > TRANSCRIPT_TAIL_MAX_LINES:
+        return _format_recent_transcript(state.get("messages", []), max_messages)
+    return "\n".join(itertools.islice(tail, max(0, len(tail) - max_messages), None))
+
+
+_SPACE_RUN_RE = re.compile(r"\s*")
+
+
 def _compact_text(value: Any, limit: int) -> str:
-    text = str(value or "").strip()
+    # Only the leading space run and the first `limit` characters are touched, not the whole value.
+    text = str(value or "")
     if len(text) <= limit:
-        return text
-    return f"{text[:limit].rstrip()}..."
+        return text.strip()
+    start = _SPACE_RUN_RE.match(text).end()
+    end = start + limit
+    if _SPACE_RUN_RE.fullmatch(text, end):
+        return text[start:].rstrip()
+    return f"{text[start:end].rstrip()}..."
+
+
+_ROLE_DRIFT_HARD_PHRASES = (
+    "as your counsellor",
+    "i need to explain",
+    "let me explain",
+    "i can help you",
+    "i will help you",
+    "our program",
+    "our course",
+    "our curriculum",
+    "our placement team",
+    "we offer",
+    "we provide",
+    "we have",
+    "we guarantee",
+)
+_ROLE_DRIFT_HARD_RES = (
+    re.compile(r"\b(?:" + "|".join(re.escape(phrase) for phrase in _ROLE_DRIFT_HARD_PHRASES) + r")\b"),
+)
+_ROLE_DRIFT_ADVISORY_MARKERS = (
+    "you should",
+    "i recommend",
+    "i suggest",
+    "please enroll",
+    "you can enroll",
+    "we can assist you with placement",
+)
 
 
-def _looks_like_student_role_drift(message: str) -> bool:
-    text = str(message or "").strip()
-    if not text:
+def _build_role_drift_automaton() -> Any:
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for phrase in _ROLE_DRIFT_HARD_PHRASES:
+        automaton.add_word(phrase, (True, len(phrase)))
+    for marker in _ROLE_DRIFT_ADVISORY_MARKERS:
+        if marker not in automaton:
+            automaton.add_word(marker, (False, len(marker)))
+    automaton.make_automaton()
+    return automaton
+
+
+_ROLE_DRIFT_AC = _build_role_drift_automaton()
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+@functools.lru_cache(maxsize=4096)
+def _role_drift_cached(lowered: str) -> bool:
+    if _ROLE_DRIFT_AC is not None:
+        # One automaton pass; hard phrases still need the word boundaries the regex had.
+        has_question = "?" in lowered
+        for end, (is_hard, length) in _ROLE_DRIFT_AC.iter(lowered):
+            if not is_hard:
+                if not has_question:
+                    return True
+                continue
+            start = end - length + 1
+            if (start == 0 or not _is_word_char(lowered[start - 1])) and (
+                end + 1 == len(lowered) or not _is_word_char(lowered[end + 1])
+            ):
+                return True
         return False
-    lowered = text.lower()
-    hard_patterns = (
-        r"\bas your counsellor\b",
-        r"\bi need to explain\b",
-        r"\blet me explain\b",
-        r"\bi can help you\b",
-        r"\bi will help you\b",
-        r"\bour (program|course|curriculum|placement team)\b",
-        r"\bwe (offer|provide|have|guarantee)\b",
-    )
-    for pattern in hard_patterns:
-        if re.search(pattern, lowered):
+    for pattern in _ROLE_DRIFT_HARD_RES:
+        if pattern.search(lowered):
             return True
-    advisory_markers = (
-        "you should",
-        "i recommend",
-        "i suggest",
-        "please enroll",
-        "you can enroll",
-        "we can assist you with placement",
-    )
-    has_advisory = any(marker in lowered for marker in advisory_markers)
-    has_question = "?" in text
+    has_advisory = any(marker in lowered for marker in _ROLE_DRIFT_ADVISORY_MARKERS)
+    has_question = "?" in lowered
     if has_advisory and not has_question:
         return True
     return False
 
 
+def _looks_like_student_role_drift(message: str) -> bool:
+    text = str(message or "").strip()
+    if not text:
+        return False
+    return _role_drift_cached(text.lower())
+
+
 def _student_program_snapshot(program: Dict[str, Any]) -> Dict[str, Any]:
     return {
         "program_name": program.get("program_name", ""),
@@ -1127,13 +2157,29 @@ def _student_program_snapshot(program: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+# Serialized snapshots keyed by id(program); the program dict is kept alongside so a recycled id is never a hit.
+# A session's program is not mutated after setup, so the JSON stays valid for the whole negotiation.
+_PROGRAM_SNAPSHOT_JSON_CACHE: Dict[int, Tuple[Dict[str, Any], str]] = {}
+PROGRAM_SNAPSHOT_JSON_CACHE_MAX_SIZE = 128
+
+
+def _program_snapshot_json(program: Dict[str, Any]) -> str:
+    key = id(program)
+    cached = _PROGRAM_SNAPSHOT_JSON_CACHE.get(key)
+    if cached is not None and cached[0] is program:
+        return cached[1]
+    serialized = _to_json_text(_student_program_snapshot(program))
+    if key not in _PROGRAM_SNAPSHOT_JSON_CACHE and len(_PROGRAM_SNAPSHOT_JSON_CACHE) >= PROGRAM_SNAPSHOT_JSON_CACHE_MAX_SIZE:
+        _PROGRAM_SNAPSHOT_JSON_CACHE.pop(next(iter(_PROGRAM_SNAPSHOT_JSON_CACHE)))
+    _PROGRAM_SNAPSHOT_JSON_CACHE[key] = (program, serialized)
+    return serialized
+
+
 def _build_retry_context_prompt(state: NegotiationState) -> str:
-    transcript = "\n".join(
-        f"{m['agent'].upper()}: {m['content']}" for m in _trim_messages(state.get("messages", []), 6)
-    )
+    transcript = _recent_transcript(state, 6)
     return (
         "RETRY_CONTEXT:\n"
-        f"PROGRAM_SNAPSHOT:\n{json.dumps(_student_program_snapshot(state.get('program', {})), ensure_ascii=False)}\n"
+        f"PROGRAM_SNAPSHOT:\n{_program_snapshot_json(state.get('program', {}))}\n"
         f"TRANSCRIPT_CONTEXT:\n{transcript}"
     )
 
@@ -1147,47 +2193,14 @@ def _resolve_selected_archetype(archetype_id: Optional[str]) -> Optional[str]:
     if not raw:
         return None
     if raw == "random":
-        return random.choice(list(ARCHETYPE_CONFIGS.keys()))
+        return random.choice(ARCHETYPE_IDS)
     if raw in ARCHETYPE_CONFIGS:
         return raw
     return None
 
 
-async def _generate_coaching_tips(
-    client: genai.Client,
-    model_name: str,
-    state: NegotiationState,
-    last_student_msg: Dict[str, Any],
-) -> Dict[str, Any]:
-    mode = str(state.get("mode", "ai_vs_ai")).strip().lower()
-    round_number = int(state.get("round", 1))
-    archetype_id = str(state.get("persona", {}).get("archetype_id", "")).strip().lower()
-    is_hindi = archetype_id == "skeptical_shopper"
-    fallback = (
-        {
-            "analysis": "मुख्य चिंता अभी भी अनसुलझी है।",
-            "suggestions": [
-                {"title": "चिंता को मान्यता दें", "description": "मैं आपकी चिंता समझता हूँ, यह एक वैध प्रश्न है।"},
-                {"title": "बाधा पूछें", "description": "क्या आपको समय या बजट को लेकर कोई विशेष परेशानी है?"},
-                {"title": "समापन प्रश्न पूछें", "description": "अगर हम इस मुद्दे को हल कर दें, तो क्या आप आज नामांकन के लिए तैयार हैं?"},
-            ],
-            "fact_check": "आपत्ति से जुड़ा एक ठोस कार्यक्रम तथ्य बताएं।",
-        }
-        if is_hindi
-        else {
-            "analysis": "Primary concern is still unresolved.",
-            "suggestions": [
-                {"title": "Acknowledge Concern", "description": "I hear your hesitation, and it is important we address this."},
-                {"title": "Probe Constraint", "description": "Is there a specific constraint stopping you right now?"},
-                {"title": "Closing Question", "description": "If we resolve this, would you be ready to proceed?"},
-            ],
-            "fact_check": "Use one concrete programme fact relevant to the objection.",
-        }
-    )
-    transcript_tail = _trim_messages(state.get("messages", []), 8)
-    program_snapshot = _student_program_snapshot(state.get("program", {}))
-    last_student_text = str(last_student_msg.get("content", "")).strip()
-    prompt = f"""
+# Static coaching prompt; per-round calls only fill the slots (program facts come from the snapshot cache).
+_COACHING_TIPS_PROMPT_TEMPLATE = """
 ROLE: Real-time Negotiation Coach.
 You are whispering to a junior counsellor in a live call.
 Be short, direct, and actionable.
@@ -1195,14 +2208,14 @@ Be short, direct, and actionable.
 CONTEXT:
 - Pipeline mode: {mode}
 - Round: {round_number}
-- Prospect archetype: {state.get("persona", {}).get("archetype_label", "Prospect")}
-- Program: {state.get("program", {}).get("program_name", "Program")}
+- Prospect archetype: {archetype_label}
+- Program: {program_name}
 
 PROGRAM FACTS:
-{json.dumps(program_snapshot, ensure_ascii=False)}
+{program_facts}
 
 TRANSCRIPT TAIL:
-{json.dumps(transcript_tail, ensure_ascii=False)}
+{transcript_tail}
 
 LAST STUDENT MESSAGE:
 {last_student_text}
@@ -1229,16 +2242,58 @@ OUTPUT JSON:
   "fact_check": "<single concrete fact>"
 }}
 """
+
+
+async def _generate_coaching_tips(
+    client: genai.Client,
+    model_name: str,
+    state: NegotiationState,
+    last_student_msg: Dict[str, Any],
+) -> Dict[str, Any]:
+    mode = str(state.get("mode", "ai_vs_ai")).strip().lower()
+    round_number = int(state.get("round", 1))
+    archetype_id = _state_archetype_lc(state)
+    is_hindi = archetype_id == "skeptical_shopper"
+    fallback = (
+        {
+            "analysis": "मुख्य चिंता अभी भी अनसुलझी है।",
+            "suggestions": [
+                {"title": "चिंता को मान्यता दें", "description": "मैं आपकी चिंता समझता हूँ, यह एक वैध प्रश्न है।"},
+                {"title": "बाधा पूछें", "description": "क्या आपको समय या बजट को लेकर कोई विशेष परेशानी है?"},
+                {"title": "समापन प्रश्न पूछें", "description": "अगर हम इस मुद्दे को हल कर दें, तो क्या आप आज नामांकन के लिए तैयार हैं?"},
+            ],
+            "fact_check": "आपत्ति से जुड़ा एक ठोस कार्यक्रम तथ्य बताएं।",
+        }
+        if is_hindi
+        else {
+            "analysis": "Primary concern is still unresolved.",
+            "suggestions": [
+                {"title": "Acknowledge Concern", "description": "I hear your hesitation, and it is important we address this."},
+                {"title": "Probe Constraint", "description": "Is there a specific constraint stopping you right now?"},
+                {"title": "Closing Question", "description": "If we resolve this, would you be ready to proceed?"},
+            ],
+            "fact_check": "Use one concrete programme fact relevant to the objection.",
+        }
+    )
+    last_student_text = str(last_student_msg.get("content", "")).strip()
+    prompt = _COACHING_TIPS_PROMPT_TEMPLATE.format(
+        mode=mode,
+        round_number=round_number,
+        archetype_label=state.get("persona", {}).get("archetype_label", "Prospect"),
+        program_name=state.get("program", {}).get("program_name", "Program"),
+        program_facts=_program_snapshot_json(state.get("program", {})),
+        transcript_tail=_to_json_text(_trim_messages(state.get("messages", []), 8)),
+        last_student_text=last_student_text,
+    )
     _write_debug_trace(
         "copilot_generate_start",
-        {
+        lambda: {
             "mode": mode,
             "round": round_number,
             "student_head": _truncate_trace_text(last_student_text, 160),
         },
     )
-    parsed = await asyncio.to_thread(
-        _call_function_json,
+    parsed = await _acall_function_json(
         client,
         model_name,
         prompt,
@@ -1300,7 +2355,7 @@ OUTPUT JSON:
     }
     _write_debug_trace(
         "copilot_generate_complete",
-        {
+        lambda: {
             "mode": mode,
             "round": round_number,
             "analysis_head": _truncate_trace_text(normalized["analysis"], 140),
@@ -1324,7 +2379,7 @@ async def _classify_human_input(
         clean_text = "..."
     _write_debug_trace(
         "human_shadow_classify_start",
-        {
+        lambda: {
             "mode": "human_vs_ai",
             "round": round_number,
             "message_id": message_id,
@@ -1348,10 +2403,9 @@ ROUND:
 {round_number}
 
 CONTEXT:
-{json.dumps(_trim_messages(state.get("messages", []), 6), ensure_ascii=False)}
+{_to_json_text(_trim_messages(state.get("messages", []), 6))}
 """
-    parsed = await asyncio.to_thread(
-        _call_function_json,
+    parsed = await _acall_function_json(
         client,
         model_name,
         prompt,
@@ -1368,6 +2422,7 @@ CONTEXT:
             "required": ["techniques", "strategic_intent", "confidence_score", "emotional_state"],
         },
         fallback,
+        cacheable=True,
     )
     parsed = _to_plain_json(parsed)
     techniques = [str(item).strip() for item in (parsed.get("techniques") or []) if str(item).strip()][:8]
@@ -1376,7 +2431,7 @@ CONTEXT:
     emotional_state = str(parsed.get("emotional_state") or fallback["emotional_state"]).strip().lower() or "calm"
     _write_debug_trace(
         "human_shadow_classify_complete",
-        {
+        lambda: {
             "mode": "human_vs_ai",
             "round": round_number,
             "message_id": message_id,
@@ -1404,10 +2459,10 @@ CONTEXT:
     }
 
 
-def _analyze_program(url: str, archetype_id: Optional[str] = None) -> Tuple[ProgramSummary, str]:
+async def _analyze_program(url: str, archetype_id: Optional[str] = None) -> Tuple[ProgramSummary, str]:
     client, negotiation_model_name, _ = get_client_and_models()
     source = "url_content"
-    clean_text = extract_from_url(url)[:25000]
+    clean_text = await _cached_extract_from_url(url)
     
     is_product = str(archetype_id).strip().lower() in ["car_buyer", "discount_hunter"]
     
@@ -1448,7 +2503,7 @@ URL: {url}
 PAGE_TEXT:
 {clean_text}
 """
-    parsed = _call_function_json(
+    parsed = await _acall_function_json(
         client=client,
         model_name=negotiation_model_name,
         prompt=prompt,
@@ -1500,16 +2555,66 @@ PAGE_TEXT:
             ],
         },
         fallback=fallback,
+        cacheable=source != "fallback",
     )
     return _to_plain_json(parsed), source
 
 
-def _generate_persona(program: ProgramSummary, forced_archetype_id: Optional[str] = None) -> StudentPersona:
+# (field, kind, low, high): "int"/"float" clamp to [low, high], "score" uses _clamp_score, "text" falls
+# back on empty values, "str_list" keeps at most `high` items and "choice" keeps a value listed in `low`,
+# else `high`. Legacy fields are kept for the UI and pricing.
+PERSONA_FIELD_SPEC: Tuple[Tuple[str, str, Any, Any], ...] = (
+    ("age", "int", 18, 50),
+    ("current_role", "text", None, None),
+    ("city_tier", "choice", ("Tier-1",), "Tier-2"),
+    ("language_style", "text", None, None),
+    ("common_vocabulary", "str_list", None, 8),
+    ("financial_anxiety", "score", None, None),
+    ("skepticism", "score", None, None),
+    ("confusion_level", "score", None, None),
+    ("ego_level", "score", None, None),
+    ("persona_type", "text", None, None),
+    ("background", "text", None, None),
+    ("career_stage", "text", None, None),
+    ("financial_sensitivity", "text", None, None),
+    ("risk_tolerance", "text", None, None),
+    ("emotional_tone", "text", None, None),
+    ("primary_objections", "str_list", None, 6),
+    ("walk_away_likelihood", "float", 0.0, 1.0),
+    ("expected_roi_months", "int", 1, 60),
+    ("affordability_concern_level", "int", 0, 100),
+    ("willingness_to_invest_score", "int", 0, 100),
+    ("communication_style", "text", None, None),
+    ("common_phrases", "str_list", None, 6),
+)
+
+
+def _coerce_fields(
+    parsed: Dict[str, Any], defaults: Dict[str, Any], spec: Tuple[Tuple[str, str, Any, Any], ...]
+) -> Dict[str, Any]:
+    for field, kind, low, high in spec:
+        if kind == "text":
+            parsed[field] = str(parsed.get(field) or defaults[field])
+        elif kind == "score":
+            parsed[field] = _clamp_score(parsed.get(field, defaults[field]))
+        elif kind == "int":
+            parsed[field] = int(max(low, min(high, int(parsed.get(field, defaults[field])))))
+        elif kind == "float":
+            parsed[field] = round(float(max(low, min(high, float(parsed.get(field, defaults[field]))))), 2)
+        elif kind == "str_list":
+            parsed[field] = [str(item) for item in (parsed.get(field) or defaults[field])][:high]
+        elif kind == "choice":
+            value = str(parsed.get(field)).strip()
+            parsed[field] = value if value in low else high
+    return parsed
+
+
+async def _generate_persona(program: ProgramSummary, forced_archetype_id: Optional[str] = None) -> StudentPersona:
     client, negotiation_model_name, _ = get_client_and_models()
     if forced_archetype_id and forced_archetype_id in ARCHETYPE_CONFIGS:
         archetype_id = forced_archetype_id
     else:
-        archetype_id = random.choice(list(ARCHETYPE_CONFIGS.keys()))
+        archetype_id = random.choice(ARCHETYPE_IDS)
     archetype = ARCHETYPE_CONFIGS.get(archetype_id, ARCHETYPE_CONFIGS["desperate_switcher"])
     selected_name, selected_gender = _pick_persona_identity(archetype_id)
     language_style = "Hindi" if archetype_id == "skeptical_shopper" else random.choice(
@@ -1538,7 +2643,7 @@ No profanity.
 {"Evaluate a high-value purchase (Car/Gadget). Focus on ownership value, specifications, and family needs." if is_product else "Evaluate an educational path. Focus on career growth, skills, and placements."}
 
 PROGRAM/PRODUCT:
-{json.dumps(program)}
+{_to_json_text(program)}
 """
     fallback_name, fallback_gender = selected_name, selected_gender
     fallback: StudentPersona = {
@@ -1581,7 +2686,7 @@ PROGRAM/PRODUCT:
             "प्लेसमेंट का भरोसा कैसे होगा?",
             "इसका करियर पर असली असर क्या है?",
         ]
-    parsed = _call_function_json(
+    parsed = await _acall_function_json(
         client=client,
         model_name=negotiation_model_name,
         prompt=prompt,
@@ -1643,36 +2748,14 @@ PROGRAM/PRODUCT:
     parsed["archetype_label"] = str(
         parsed.get("archetype_label") or ARCHETYPE_LABELS.get(parsed["archetype_id"], parsed["archetype_id"])
     )
-    parsed["age"] = int(max(18, min(50, int(parsed.get("age", fallback["age"])))))
-    parsed["current_role"] = str(parsed.get("current_role") or fallback["current_role"])
-    parsed["city_tier"] = "Tier-1" if str(parsed.get("city_tier")).strip() == "Tier-1" else "Tier-2"
-    parsed["language_style"] = (
-        "Hindi" if parsed["archetype_id"] == "skeptical_shopper" else str(parsed.get("language_style") or fallback["language_style"])
-    )
-    parsed["common_vocabulary"] = [str(item) for item in (parsed.get("common_vocabulary") or fallback["common_vocabulary"])][:8]
-    parsed["financial_anxiety"] = _clamp_score(parsed.get("financial_anxiety", fallback["financial_anxiety"]))
-    parsed["skepticism"] = _clamp_score(parsed.get("skepticism", fallback["skepticism"]))
-    parsed["confusion_level"] = _clamp_score(parsed.get("confusion_level", fallback["confusion_level"]))
-    parsed["ego_level"] = _clamp_score(parsed.get("ego_level", fallback["ego_level"]))
-    # Legacy-compatible fields expected by current UI and pricing logic.
-    parsed["persona_type"] = str(parsed.get("persona_type") or parsed["archetype_id"])
-    parsed["background"] = str(parsed.get("background") or fallback["background"])
-    parsed["career_stage"] = str(parsed.get("career_stage") or fallback["career_stage"])
-    parsed["financial_sensitivity"] = str(parsed.get("financial_sensitivity") or fallback["financial_sensitivity"])
-    parsed["risk_tolerance"] = str(parsed.get("risk_tolerance") or fallback["risk_tolerance"])
-    parsed["emotional_tone"] = str(parsed.get("emotional_tone") or fallback["emotional_tone"])
-    parsed["primary_objections"] = [str(item) for item in (parsed.get("primary_objections") or fallback["primary_objections"])][:6]
-    parsed["walk_away_likelihood"] = float(max(0.0, min(1.0, float(parsed.get("walk_away_likelihood", fallback["walk_away_likelihood"])))))
-    parsed["expected_roi_months"] = int(max(1, min(60, int(parsed.get("expected_roi_months", fallback["expected_roi_months"])))))
-    parsed["affordability_concern_level"] = int(max(0, min(100, int(parsed.get("affordability_concern_level", fallback["affordability_concern_level"])))))
-    parsed["willingness_to_invest_score"] = int(max(0, min(100, int(parsed.get("willingness_to_invest_score", fallback["willingness_to_invest_score"])))))
-    parsed["communication_style"] = str(parsed.get("communication_style") or fallback["communication_style"])
-    parsed["common_phrases"] = [str(item) for item in (parsed.get("common_phrases") or fallback["common_phrases"])][:6]
+    if parsed["archetype_id"] == "skeptical_shopper":
+        parsed["language_style"] = "Hindi"
+    _coerce_fields(parsed, {**fallback, "persona_type": parsed["archetype_id"]}, PERSONA_FIELD_SPEC)
     return parsed
 
 
-def _is_valid_student_persona_schema(persona: Dict[str, Any]) -> bool:
-    required = {
+_REQUIRED_PERSONA_FIELDS = frozenset(
+    {
         "gender",
         "archetype_id",
         "archetype_label",
@@ -1690,115 +2773,71 @@ def _is_valid_student_persona_schema(persona: Dict[str, Any]) -> bool:
         "confusion_level",
         "ego_level",
     }
-    return required.issubset(set(persona.keys()))
+)
+
+
+def _is_valid_student_persona_schema(persona: Dict[str, Any]) -> bool:
+    return _REQUIRED_PERSONA_FIELDS <= persona.keys()
+
+
+def _state_archetype_lc(state: NegotiationState) -> str:
+    archetype_lc = state.get("archetype_id_lc")
+    if archetype_lc is None:
+        archetype_lc = str(state.get("persona", {}).get("archetype_id", "")).strip().lower()
+    return archetype_lc
+
+
+def _cached_prompt_header(state: NegotiationState, agent: str, build: Any) -> str:
+    # Headers are byte-identical for a whole negotiation, so they are built once per state. Keeping them
+    # ahead of the per-turn tail lets Gemini's implicit prefix caching reuse them across turns.
+    program_name = str(state.get("program", {}).get("program_name", ""))
+    archetype_id = _state_archetype_lc(state)
+    key = f"{agent}|{archetype_id}|{state.get('mode', '')}|{program_name}"
+    headers = state.setdefault("prompt_headers", {})
+    header = headers.get(key)
+    if header is None:
+        header = headers[key] = build(state)
+    return header
 
 
 def _build_counsellor_prompt(state: NegotiationState) -> str:
-    transcript = "\n".join(
-        f"{m['agent'].upper()}: {m['content']}" for m in _trim_messages(state["messages"], 12)
-    )
-    retry_context = state.get("retry_context", {})
-    retry_note = ""
-    if retry_context.get("is_retry"):
-        mistakes = retry_context.get("mistakes", [])
-        unresolved = retry_context.get("primary_unresolved_objection", "Not specified")
-        retry_note = f"""
-PREVIOUS ATTEMPT FAILED.
-Failure Reasons:
-- {", ".join(mistakes) if mistakes else "Not available"}
-- Unresolved Objection: {unresolved}
-In this run:
-- Correct previous mistakes.
-- Resolve the main objection earlier.
-- Improve emotional calibration.
-"""
-    persona = state.get("persona", {})
-    archetype_id = str(persona.get("archetype_id", "")).strip().lower()
-    if archetype_id == "skeptical_shopper":
-        counsellor_language_rules = (
-            "LANGUAGE REQUIREMENT:\n"
-            "- Speak only in natural Hindi (Devanagari script).\n"
-            "- No Hinglish, no English code-mixing.\n"
-            "- This rule applies from the very first counsellor turn."
-        )
-    else:
-        counsellor_language_rules = (
-            "LANGUAGE REQUIREMENT:\n"
-            "- Use clear, professional English matching the active simulation style."
-        )
-        
-    role_title = "Senior Admissions Counsellor"
-    objective_term = "enrollment"
-    product_label = "PROGRAM"
-    do_not_rules = (
-        "- Promise guaranteed jobs\n"
-        "- Overstate placement outcomes\n"
-        "- Invent program details"
-    )
-    customer_term = "student"
-    intent_examples = "fee, placement, eligibility, curriculum, duration, financing, outcomes, comparison, trust-risk"
-    nudge_examples = (
-        "  - \"Would you like a quick view of the capstone outcomes?\"\n"
-        "  - \"Should I break down placement eligibility in 30 seconds?\"\n"
-        "  - \"Do you want a fee + EMI snapshot for your case?\""
-    )
-    
-    if archetype_id in ["car_buyer", "discount_hunter"]:
-        role_title = "Expert Product Specialist / Sales Executive"
-        objective_term = "purchase"
-        product_label = "PRODUCT"
-        do_not_rules = (
-            "- Promise unrealistic discounts\n"
-            "- Overstate product features or warranty\n"
-            "- Invent product specifications"
-        )
-        customer_term = "customer"
-        intent_examples = "price, features, warranty, specifications, financing, delivery, comparison, trust-risk"
-        nudge_examples = (
-          "  - \"Would you like a quick breakdown of the key features?\"\n"
-          "  - \"Should I explain the warranty and service terms in 30 seconds?\"\n"
-          "  - \"Do you want a price + EMI snapshot for this model?\""
-        )
-        # Map program keys to product keys for better LLM alignment
-        p = state['program']
-        data_block = f"""
-SPECIFIC {product_label} IDENTITY:
-- Name: {p.get('program_name')}
-- Type: {p.get('target_audience')} (derived from context)
-- Value Prop: {p.get('value_proposition')}
+    return _cached_prompt_header(state, "counsellor", _static_counsellor_header) + _dynamic_counsellor_tail(state)
 
-TECHNICAL SPECIFICATIONS & DETAILS:
-- Key Features: {", ".join(p.get('key_features', []))}
-- Price/Fee: {p.get('program_fee_inr')}
-- Financing: {p.get('emi_or_financing_options')}
-- Other Details: {p.get('positioning_angle')}
-"""
-    else:
-        # Default Admissions context
-        data_block = f"{product_label} DATA:\n{json.dumps(state['program'])}"
 
+def _dynamic_counsellor_tail(state: NegotiationState) -> str:
+    transcript = _recent_transcript(state, 12)
     return f"""
-ROLE: {role_title}.
-CRITICAL IDENTITY RULE: You are selling the {product_label} named "{state['program'].get('program_name')}". 
+PRIOR TRANSCRIPT:
+{transcript}
+
+Reply now with the next counsellor turn, following the OUTPUT FORMAT above.
+"""
+
+
+# Archetype prose is baked into one string.Template per archetype at import time; only the
+# session-specific slots ($program_name, $data_block, $retry_note, ...) are filled per header.
+def _counsellor_header_template(profile: Dict[str, str]) -> string.Template:
+    esc = {key: value.replace("$", "$$") for key, value in profile.items()}
+    return string.Template(
+        f"""
+ROLE: {esc['role_title']}.
+CRITICAL IDENTITY RULE: You are selling the {esc['product_label']} named "${{program_name}}". 
 DO NOT mention or sell any other items, routers, courses, or programs.
 
 PRIMARY OBJECTIVE:
-Guide the {customer_term} toward a confident {objective_term} decision using only factual {product_label.lower()} data.
+Guide the {esc['customer_term']} toward a confident {esc['objective_term']} decision using only factual {esc['product_label'].lower()} data.
 
 DO NOT:
-{do_not_rules}
+{esc['do_not_rules']}
 
-{data_block}
-
-PRIOR TRANSCRIPT:
-{transcript}
-{retry_note}
-{counsellor_language_rules}
+${{data_block}}
+${{retry_note}}
+{esc['language_rules']}
 
 STRATEGY REQUIREMENTS:
-- First detect {customer_term} intent from transcript ({intent_examples}).
+- First detect {esc['customer_term']} intent from transcript ({esc['intent_examples']}).
 - Answer the detected intent first and directly.
-- If the {customer_term} asks a specific question, do NOT dump unrelated information.
+- If the {esc['customer_term']} asks a specific question, do NOT dump unrelated information.
 - Use exactly one concrete proof point (number, criterion, timeline, or policy) relevant to the asked intent.
 - Keep language conversational and crisp; avoid lecture-like tone.
 - Build trust gradually and reduce anxiety using facts, not hype.
@@ -1808,7 +2847,7 @@ STRATEGY REQUIREMENTS:
 ENGAGEMENT / SALES QUALITY RULE:
 - After answering, optionally add one high-value engagement nudge only when context supports it.
 - Good nudge examples:
-{nudge_examples}
+{esc['nudge_examples']}
 - Use at most one nudge per turn.
 - Do not nudge if user asked to be brief or is visibly frustrated.
 
@@ -1827,74 +2866,106 @@ Quality constraints:
 - Always end with a complete sentence.
 - Do not end mid-phrase (for example ending with words like "to", "and", "if this is", "aapki", etc.).
 """
+    )
 
 
-def _build_student_prompt(state: NegotiationState) -> str:
-    transcript = "\n".join(
-        f"{m['agent'].upper()}: {m['content']}" for m in _trim_messages(state["messages"], 6)
-    )
-    persona = state["persona"]
-    inner_state = state.get("student_inner_state", {})
-    config = ARCHETYPE_CONFIGS.get(persona.get("archetype_id", "desperate_switcher"), ARCHETYPE_CONFIGS["desperate_switcher"])
-    mode = str(state.get("mode", "ai_vs_ai")).strip().lower()
-    archetype_id = str(persona.get("archetype_id", "")).strip().lower()
-    vocabulary = ", ".join(persona.get("common_vocabulary", []))
-    program_snapshot = _student_program_snapshot(state["program"])
-    if archetype_id == "skeptical_shopper":
-        language_style = "Hindi"
-        language_instruction = "Respond only in natural Hindi (Devanagari script). No Hinglish or English phrases."
-        vocabulary = "फीस, प्लेसमेंट, नौकरी, भरोसा, रिटर्न ऑन इन्वेस्टमेंट, करियर ग्रोथ"
-        pipeline_language_fragment = (
-            "- Mandatory language rule: speak only in Hindi (Devanagari).\n"
-            "- Never use Hinglish/code-mix.\n"
-            "- If counsellor speaks English, still reply in Hindi."
-        )
-    elif mode in {"human_vs_ai", "agent_powered_human_vs_ai"}:
-        language_style = "UK English"
-        language_instruction = (
-            "Use pure UK English only. No Hinglish, no Hindi words, and no code-mixing."
-        )
-        vocabulary = "career progression, return on investment, placement outcomes, programme structure, practical projects"
-        pipeline_language_fragment = (
-            "- Human-vs-AI pipeline rule: respond only in natural UK English.\n"
-            "- Never use colloquial Hindi/Hinglish terms (for example: bhaiya, yaar, kya, paisa, scene)."
-        )
+COUNSELLOR_HEADER_TEMPLATES: Dict[str, string.Template] = {
+    archetype_id: _counsellor_header_template(profile) for archetype_id, profile in COUNSELLOR_ARCHETYPE_PROFILE.items()
+}
+_DEFAULT_COUNSELLOR_HEADER_TEMPLATE = _counsellor_header_template(_PROGRAM_COUNSELLOR_PROFILE)
+
+
+def _static_counsellor_header(state: NegotiationState) -> str:
+    retry_context = state.get("retry_context", {})
+    retry_note = ""
+    if retry_context.get("is_retry"):
+        mistakes = retry_context.get("mistakes", [])
+        unresolved = retry_context.get("primary_unresolved_objection", "Not specified")
+        retry_note = f"""
+PREVIOUS ATTEMPT FAILED.
+Failure Reasons:
+- {", ".join(mistakes) if mistakes else "Not available"}
+- Unresolved Objection: {unresolved}
+In this run:
+- Correct previous mistakes.
+- Resolve the main objection earlier.
+- Improve emotional calibration.
+"""
+    persona = state.get("persona", {})
+    archetype_id = _state_archetype_lc(state)
+    profile = COUNSELLOR_ARCHETYPE_PROFILE.get(archetype_id, _PROGRAM_COUNSELLOR_PROFILE)
+    product_label = profile["product_label"]
+
+    if archetype_id in PRODUCT_ARCHETYPE_IDS:
+        # Map program keys to product keys for better LLM alignment
+        p = state['program']
+        data_block = f"""
+SPECIFIC {product_label} IDENTITY:
+- Name: {p.get('program_name')}
+- Type: {p.get('target_audience')} (derived from context)
+- Value Prop: {p.get('value_proposition')}
+
+TECHNICAL SPECIFICATIONS & DETAILS:
+- Key Features: {", ".join(p.get('key_features', []))}
+- Price/Fee: {p.get('program_fee_inr')}
+- Financing: {p.get('emi_or_financing_options')}
+- Other Details: {p.get('positioning_angle')}
+"""
     else:
-        language_style = str(persona.get("language_style") or "Indian English")
-        language_instruction = str(config.get("language_instruction") or "Use clear Indian English.")
-        pipeline_language_fragment = "- Keep language aligned with archetype profile."
-        
-    product_label = "PRODUCT" if archetype_id in ["car_buyer", "discount_hunter"] else "PROGRAM"
+        # Default Admissions context
+        data_block = f"{product_label} DATA:\n{_to_json_text(state['program'])}"
 
-    return f"""
-ROLE: You are {persona.get('name')}, a {persona.get('age')} year old {persona.get('current_role')}.
-ARCHETYPE: {persona.get('archetype_label')}
-CITY CONTEXT: {persona.get('city_tier')}
+    return COUNSELLOR_HEADER_TEMPLATES.get(archetype_id, _DEFAULT_COUNSELLOR_HEADER_TEMPLATE).substitute(
+        program_name=state["program"].get("program_name"),
+        data_block=data_block,
+        retry_note=retry_note,
+    )
 
-YOUR STORY: {_compact_text(persona.get('backstory'), 320)}
-HIDDEN SECRET: {_compact_text(persona.get('hidden_secret'), 200)}
-MISCONCEPTION: {_compact_text(persona.get('misconception'), 180)}
 
---- PSYCHOLOGICAL PROFILE ---
-PRIMARY MOTIVATION: {config.get('core_drive')}
-WHAT STRESSES YOU: {config.get('stress_trigger')}
-YOUR DEFAULT REACTION: {config.get('emotional_response')}
-LANGUAGE STYLE: {language_style}
-LANGUAGE INSTRUCTION: {language_instruction}
-COMMON VOCABULARY: {vocabulary}
+def _build_student_prompt(state: NegotiationState) -> str:
+    return _cached_prompt_header(state, "student", _static_student_header) + _dynamic_student_tail(state)
 
+
+def _dynamic_student_tail(state: NegotiationState) -> str:
+    transcript = _recent_transcript(state, 6)
+    inner_state = state.get("student_inner_state", {})
+    return f"""
 CURRENT STATE:
 - sentiment: {inner_state.get('sentiment', 'curious')}
 - resistance_level: {inner_state.get('skepticism_level', 50)}/100
 - trust_level: {inner_state.get('trust_score', 50)}/100
 - unresolved_concerns: {", ".join(inner_state.get('unresolved_concerns', [])) or "none"}
 
-{product_label}:
-{json.dumps(program_snapshot)}
-
 TRANSCRIPT SO FAR:
 {transcript}
 
+Respond now using only the tags in the OUTPUT FORMAT above.
+"""
+
+
+def _student_header_template(config: Dict[str, str]) -> string.Template:
+    esc = {key: value.replace("$", "$$") for key, value in config.items()}
+    return string.Template(
+        f"""
+ROLE: You are ${{name}}, a ${{age}} year old ${{current_role}}.
+ARCHETYPE: ${{archetype_label}}
+CITY CONTEXT: ${{city_tier}}
+
+YOUR STORY: ${{backstory}}
+HIDDEN SECRET: ${{hidden_secret}}
+MISCONCEPTION: ${{misconception}}
+
+--- PSYCHOLOGICAL PROFILE ---
+PRIMARY MOTIVATION: {esc.get('core_drive')}
+WHAT STRESSES YOU: {esc.get('stress_trigger')}
+YOUR DEFAULT REACTION: {esc.get('emotional_response')}
+LANGUAGE STYLE: ${{language_style}}
+LANGUAGE INSTRUCTION: ${{language_instruction}}
+COMMON VOCABULARY: ${{vocabulary}}
+
+${{product_label}}:
+${{program_json}}
+
 --- INSTRUCTIONS ---
 1. ANALYZE RESPONSE:
 - Did counsellor address PRIMARY MOTIVATION?
@@ -1905,7 +2976,7 @@ TRANSCRIPT SO FAR:
 - Speak naturally per LANGUAGE STYLE and vocabulary.
 - Do not reveal hidden secret too early.
 - Repeat unresolved concerns if still unanswered.
-{pipeline_language_fragment}
+${{pipeline_language_fragment}}
 4. Keep MESSAGE natural and concise:
 - 1 to 4 sentences.
 - Target 80 to 120 words (hard cap 120 words).
@@ -1913,17 +2984,72 @@ TRANSCRIPT SO FAR:
 - Include a slight emotional undertone without becoming theatrical.
 - Keep MESSAGE complete and do not cut mid sentence.
 
---- OUTPUT FORMAT ---
-<thought>raw inner monologue</thought>
-<stats>{{"resistance": <int>, "trust": <int>, "sentiment": "<str>", "unresolved_concerns": ["<concern>"]}}</stats>
-<message>spoken response</message>
-<emotional_state>calm/frustrated/confused/excited/skeptical</emotional_state>
-<intent>why responding this way</intent>
-Do not output anything outside these tags.
-"""
+--- OUTPUT FORMAT ---
+<thought>raw inner monologue</thought>
+<stats>{{"resistance": <int>, "trust": <int>, "sentiment": "<str>", "unresolved_concerns": ["<concern>"]}}</stats>
+<message>spoken response</message>
+<emotional_state>calm/frustrated/confused/excited/skeptical</emotional_state>
+<intent>why responding this way</intent>
+Do not output anything outside these tags.
+"""
+    )
+
+
+STUDENT_HEADER_TEMPLATES: Dict[str, string.Template] = {
+    archetype_id: _student_header_template(config) for archetype_id, config in ARCHETYPE_CONFIGS.items()
+}
+_DEFAULT_STUDENT_HEADER_TEMPLATE = STUDENT_HEADER_TEMPLATES["desperate_switcher"]
+
+
+def _static_student_header(state: NegotiationState) -> str:
+    persona = state["persona"]
+    config = ARCHETYPE_CONFIGS.get(persona.get("archetype_id", "desperate_switcher"), ARCHETYPE_CONFIGS["desperate_switcher"])
+    mode = str(state.get("mode", "ai_vs_ai")).strip().lower()
+    archetype_id = _state_archetype_lc(state)
+    vocabulary = ", ".join(persona.get("common_vocabulary", []))
+    language_profile = STUDENT_LANGUAGE_PROFILE.get((archetype_id, mode))
+    if language_profile is None and mode in HUMAN_NEGOTIATION_MODES:
+        language_profile = _UK_ENGLISH_STUDENT_LANGUAGE_PROFILE
+    if language_profile is not None:
+        language_style = language_profile["language_style"]
+        language_instruction = language_profile["language_instruction"]
+        vocabulary = language_profile["vocabulary"]
+        pipeline_language_fragment = language_profile["pipeline_language_fragment"]
+    else:
+        language_style = str(persona.get("language_style") or "Indian English")
+        language_instruction = str(config.get("language_instruction") or "Use clear Indian English.")
+        pipeline_language_fragment = "- Keep language aligned with archetype profile."
+
+    product_label = "PRODUCT" if archetype_id in PRODUCT_ARCHETYPE_IDS else "PROGRAM"
+
+    return STUDENT_HEADER_TEMPLATES.get(persona.get("archetype_id", "desperate_switcher"), _DEFAULT_STUDENT_HEADER_TEMPLATE).substitute(
+        name=persona.get("name"),
+        age=persona.get("age"),
+        current_role=persona.get("current_role"),
+        archetype_label=persona.get("archetype_label"),
+        city_tier=persona.get("city_tier"),
+        backstory=_compact_text(persona.get("backstory"), 320),
+        hidden_secret=_compact_text(persona.get("hidden_secret"), 200),
+        misconception=_compact_text(persona.get("misconception"), 180),
+        language_style=language_style,
+        language_instruction=language_instruction,
+        vocabulary=vocabulary,
+        product_label=product_label,
+        program_json=_program_snapshot_json(state["program"]),
+        pipeline_language_fragment=pipeline_language_fragment,
+    )
+
 
+def _pick_student_retry_candidate(payloads: List[Dict[str, Any]], fallback_message: str) -> Dict[str, Any]:
+    # Prefer a real model answer that stays in the learner role, then the canned fallback, then the first drift.
+    in_role = [item for item in payloads if not _looks_like_student_role_drift(str(item.get("message", "")).strip())]
+    for item in in_role:
+        if str(item.get("message", "")).strip() != fallback_message:
+            return item
+    return in_role[0] if in_role else payloads[0]
 
-def _retry_with_structured_json(
+
+async def _retry_with_structured_json(
     client: genai.Client,
     model_name: str,
     agent: str,
@@ -1955,28 +3081,36 @@ ROLE LOCK (MANDATORY):
 - End MESSAGE with a complete sentence, ideally with at least one question if concerns remain.
 {retry_context_prompt}
 """
-        parsed = _call_function_json(
-            client=client,
-            model_name=model_name,
-            prompt=retry_prompt,
-            function_name="set_retry_student_response",
-            function_description="Return a complete learner turn in structured JSON format.",
-            parameters_schema={
-                "type": "object",
-                "properties": {
-                    "message": {"type": "string"},
-                    "internal_thought": {"type": "string"},
-                    "updated_stats": {"type": "object"},
-                    "emotional_state": {"type": "string"},
-                    "intent": {"type": "string"},
-                    "confidence_score": {"type": "number"},
-                    "techniques": {"type": "array", "items": {"type": "string"}},
+
+        def request_candidate() -> Awaitable[Dict[str, Any]]:
+            return _acall_function_json(
+                client=client,
+                model_name=model_name,
+                prompt=retry_prompt,
+                function_name="set_retry_student_response",
+                function_description="Return a complete learner turn in structured JSON format.",
+                parameters_schema={
+                    "type": "object",
+                    "properties": {
+                        "message": {"type": "string"},
+                        "internal_thought": {"type": "string"},
+                        "updated_stats": {"type": "object"},
+                        "emotional_state": {"type": "string"},
+                        "intent": {"type": "string"},
+                        "confidence_score": {"type": "number"},
+                        "techniques": {"type": "array", "items": {"type": "string"}},
+                    },
+                    "required": ["message"],
                 },
-                "required": ["message"],
-            },
-            fallback=fallback,
-        )
-        payload = _to_plain_json(parsed)
+                fallback=fallback,
+            )
+
+        if STUDENT_RETRY_CANDIDATES > 1:
+            # Opt-in fan-out; the guarded rewrite below is then only needed when every candidate drifts.
+            candidates = await asyncio.gather(*(request_candidate() for _ in range(STUDENT_RETRY_CANDIDATES)))
+            payload = _pick_student_retry_candidate([_to_plain_json(item) for item in candidates], fallback["message"])
+        else:
+            payload = _to_plain_json(await request_candidate())
         message = str(payload.get("message", "")).strip()
         if _looks_like_student_role_drift(message):
             logger.warning("Student retry output drifted into counsellor role; running guarded rewrite.")
@@ -1996,7 +3130,7 @@ INVALID MESSAGE:
 {retry_context_prompt}
 """
             payload = _to_plain_json(
-                _call_function_json(
+                await _acall_function_json(
                     client=client,
                     model_name=model_name,
                     prompt=rewrite_prompt,
@@ -2044,7 +3178,7 @@ Keep message under 180 words and end in a complete sentence.
 Use only this context and do not invent details outside it.
 {retry_context_prompt}
 """
-    parsed = _call_function_json(
+    parsed = await _acall_function_json(
         client=client,
         model_name=model_name,
         prompt=retry_prompt,
@@ -2066,6 +3200,129 @@ Use only this context and do not invent details outside it.
     return _to_plain_json(parsed)
 
 
+class _StreamBatcher:
+    """Coalesces streamed text fragments into fewer stream_chunk frames for one message."""
+
+    def __init__(self, websocket: WebSocket, agent: str, message_id: str) -> None:
+        self._websocket = websocket
+        self._window = NEGOTIATION_STREAM_BATCH_WINDOW_MS / 1000.0
+        self._max_chars = NEGOTIATION_STREAM_BATCH_MAX_CHARS
+        # Every frame of this message shares the same envelope; only the escaped text varies.
+        self._frame_prefix = (
+            f'{{"type":"stream_chunk","data":{{"agent":{_to_json_text(agent)},'
+            f'"message_id":{_to_json_text(message_id)},"text":'
+        )
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, text: str) -> None:
+        if self._task.done():
+            # Surface writer failures (e.g. client disconnect) to the producer.
+            self._task.result()
+            return
+        self._queue.put_nowait(text)
+
+    async def close(self) -> None:
+        if not self._task.done():
+            self._queue.put_nowait(None)
+        await self._task
+
+    def abort(self) -> None:
+        self._task.cancel()
+
+    async def _writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            first = await self._queue.get()
+            if first is None:
+                return
+            pending = [first]
+            size = len(first)
+            deadline = loop.time() + self._window
+            while size < self._max_chars:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                pending.append(item)
+                size += len(item)
+            await _ws_send_frame(self._websocket, f"{self._frame_prefix}{_to_json_text(''.join(pending))}}}}}")
+
+
+async def _open_agent_stream(
+    client: genai.Client, model_name: str, prompt: str
+) -> AsyncIterator[types.GenerateContentResponse]:
+    config = types.GenerateContentConfig(
+        temperature=0.85,
+        top_p=0.95,
+    )
+    # Opening is retried only on quota/server errors; an idle timeout goes straight to the structured retry.
+    async for attempt in AsyncRetrying(**_gemini_retry_policy(_is_gemini_overload)):
+        with attempt:
+            return await asyncio.wait_for(
+                client.aio.models.generate_content_stream(
+                    model=model_name,
+                    contents=prompt,
+                    config=config,
+                ),
+                timeout=NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS,
+            )
+    raise RuntimeError("unreachable: retry policy re-raises the last error")
+
+
+class _SpeculativeStream:
+    """A counsellor stream opened before the student turn finishes, used only if its prompt still matches."""
+
+    def __init__(self, client: genai.Client, model_name: str, prompt: str) -> None:
+        self.prompt = prompt
+        self._task = asyncio.create_task(self._open(client, model_name, prompt))
+
+    async def _open(
+        self, client: genai.Client, model_name: str, prompt: str
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        await _GEMINI_SEM.acquire()
+        try:
+            return await _open_agent_stream(client, model_name, prompt)
+        except BaseException:
+            _GEMINI_SEM.release()
+            raise
+
+    async def claim(self, prompt: str) -> Optional[AsyncIterator[types.GenerateContentResponse]]:
+        # On a hit the caller takes over the stream and its semaphore slot.
+        if prompt != self.prompt:
+            await self.discard()
+            return None
+        try:
+            return await self._task
+        except Exception:
+            logger.debug("Speculative counsellor stream failed to open", exc_info=True)
+            return None
+
+    async def discard(self) -> None:
+        self._task.cancel()
+        try:
+            response_stream = await self._task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            return
+        except Exception:
+            return
+        try:
+            await response_stream.aclose()
+        except Exception:
+            logger.debug("Failed to close speculative counsellor stream", exc_info=True)
+        finally:
+            _GEMINI_SEM.release()
+
+
 async def _stream_agent_response(
     websocket: WebSocket,
     client: genai.Client,
@@ -2079,107 +3336,121 @@ async def _stream_agent_response(
     mode: str,
     student_inner_state: Optional[Dict[str, int]] = None,
     student_persona: Optional[Dict[str, Any]] = None,
+    prefetched_stream: Optional[AsyncIterator[types.GenerateContentResponse]] = None,
+    on_message_closed: Optional[Callable[[str], None]] = None,
 ) -> Dict[str, Any]:
     full_text = ""
     stream_chunk_count = 0
     stream_nonempty_chunk_count = 0
     stream_finish_reasons: List[str] = []
+    batcher: Optional[_StreamBatcher] = None
+    response_stream: Optional[AsyncIterator[types.GenerateContentResponse]] = None
+    marker_stream = _ResponseMarkerStream()
+    holds_gemini_slot = False
     _write_debug_trace(
         "turn_start",
-        {
+        lambda: {
             "agent": agent,
             "mode": mode,
             "round": round_number,
             "message_id": message_id,
             "model": model_name,
             "prompt_len": len(prompt or ""),
-            "prompt_sha256": _sha256_hex(prompt or ""),
+            "prompt_fingerprint": _prompt_fingerprint(prompt or ""),
             "prompt_head": _truncate_trace_text(prompt, 180),
         },
     )
     try:
-        config_kwargs: Dict[str, Any] = {
-            "temperature": 0.85,
-            "top_p": 0.95,
-        }
-        config = types.GenerateContentConfig(
-            **config_kwargs,
-        )
-        stream_queue: queue.Queue = queue.Queue()
-
-        def _stream_worker() -> None:
-            try:
-                response_stream = client.models.generate_content_stream(
-                    model=model_name,
-                    contents=prompt,
-                    config=config,
-                )
-                for next_chunk in response_stream:
-                    stream_queue.put(("chunk", next_chunk))
-                stream_queue.put(("done", None))
-            except Exception as worker_exc:
-                stream_queue.put(("error", worker_exc))
-
-        threading.Thread(target=_stream_worker, daemon=True).start()
-
-        while True:
-            try:
-                event_type, payload = await asyncio.wait_for(
-                    asyncio.to_thread(stream_queue.get),
-                    timeout=NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS,
-                )
-            except asyncio.TimeoutError as timeout_exc:
-                raise TimeoutError(
-                    f"{agent} stream idle timeout after {NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS}s"
-                ) from timeout_exc
-
-            if event_type == "done":
-                break
-            if event_type == "error":
-                raise payload
-
-            chunk = payload
-            stream_chunk_count += 1
-            chunk_reasons = _collect_chunk_finish_reasons(chunk)
-            if chunk_reasons:
-                stream_finish_reasons.extend(chunk_reasons)
-            text = _extract_chunk_text(chunk)
-            if not text:
-                if NEGOTIATION_STREAM_CONSOLE_LOG:
-                    logger.info(
-                        "[LLM_STREAM] agent=%s round=%s message_id=%s chunk=%s chars=0 finish_reasons=%s",
-                        agent,
-                        round_number,
-                        message_id,
-                        stream_chunk_count,
-                        chunk_reasons,
-                    )
-                continue
-            stream_nonempty_chunk_count += 1
-            full_text += text
-            if NEGOTIATION_STREAM_CONSOLE_LOG:
-                logger.info(
-                    "[LLM_STREAM] agent=%s round=%s message_id=%s chunk=%s chars=%s finish_reasons=%s text=%r",
-                    agent,
-                    round_number,
-                    message_id,
-                    stream_chunk_count,
-                    len(text),
-                    chunk_reasons,
-                    text,
-                )
-            await _ws_send_json(
-                websocket,
-                {"type": "stream_chunk", "data": {"agent": agent, "text": text, "message_id": message_id}},
-            )
-            if demo_mode:
-                await asyncio.sleep(0.03)
+        # The slot is held until the stream is closed; a prefetched stream arrives already holding one.
+        if prefetched_stream is not None:
+            holds_gemini_slot = True
+            response_stream = prefetched_stream
+        else:
+            await _GEMINI_SEM.acquire()
+            holds_gemini_slot = True
+            response_stream = await _open_agent_stream(client, model_name, prompt)
+        batcher = _StreamBatcher(websocket, agent, message_id)
+
+        # One idle deadline per stream, pushed forward as each chunk lands, instead of a wait_for
+        # timer and wrapper task per chunk.
+        loop = asyncio.get_running_loop()
+        try:
+            async with asyncio.timeout(NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS) as idle_deadline:
+                async for chunk in response_stream:
+                    idle_deadline.reschedule(loop.time() + NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS)
+                    stream_chunk_count += 1
+                    chunk_reasons = _collect_chunk_finish_reasons(chunk)
+                    if chunk_reasons:
+                        stream_finish_reasons.extend(chunk_reasons)
+                    text = _extract_chunk_text(chunk)
+                    if not text:
+                        if NEGOTIATION_STREAM_CONSOLE_LOG:
+                            logger.info(
+                                "[LLM_STREAM] agent=%s round=%s message_id=%s chunk=%s chars=0 finish_reasons=%s",
+                                agent,
+                                round_number,
+                                message_id,
+                                stream_chunk_count,
+                                chunk_reasons,
+                            )
+                        continue
+                    stream_nonempty_chunk_count += 1
+                    full_text += text
+                    message_was_closed = marker_stream.message_closed
+                    marker_stream.feed(text)
+                    if marker_stream.message_closed and not message_was_closed:
+                        # The message field is complete here, before stats/intent finish streaming.
+                        _write_debug_trace(
+                            "message_closed",
+                            lambda: {
+                                "agent": agent,
+                                "round": round_number,
+                                "message_id": message_id,
+                                "chunk_count": stream_chunk_count,
+                                "buffer_chars": len(full_text),
+                            },
+                        )
+                        if on_message_closed is not None:
+                            on_message_closed(full_text)
+                    if NEGOTIATION_STREAM_CONSOLE_LOG:
+                        logger.info(
+                            "[LLM_STREAM] agent=%s round=%s message_id=%s chunk=%s chars=%s finish_reasons=%s text=%r",
+                            agent,
+                            round_number,
+                            message_id,
+                            stream_chunk_count,
+                            len(text),
+                            chunk_reasons,
+                            text,
+                        )
+                    batcher.put(text)
+                    if demo_mode and NEGOTIATION_DEMO_PACING:
+                        await asyncio.sleep(0.03)
+        except TimeoutError as timeout_exc:
+            raise TimeoutError(
+                f"{agent} stream idle timeout after {NEGOTIATION_STREAM_IDLE_TIMEOUT_SECONDS}s"
+            ) from timeout_exc
+        await batcher.close()
+    except asyncio.CancelledError:
+        if batcher is not None:
+            batcher.abort()
+        raise
     except Exception as exc:
+        if batcher is not None and not isinstance(exc, TimeoutError):
+            batcher.abort()
         if isinstance(exc, TimeoutError):
+            if batcher is not None:
+                # Flush fragments already received so the client sees the same partial text as before.
+                try:
+                    await batcher.close()
+                except ClientStreamClosed:
+                    logger.info("Client disconnected while streaming %s", agent)
+                    raise
+
             logger.warning("Streaming idle timeout for %s; switching to structured retry.", agent)
             _write_debug_trace(
                 "stream_timeout",
-                {
+                lambda: {
                     "agent": agent,
                     "mode": mode,
                     "round": round_number,
@@ -2192,19 +3463,13 @@ async def _stream_agent_response(
             )
             full_text = ""
         else:
-            marker = f"{type(exc).__name__}: {exc}"
-            disconnected = (
-                "ClientDisconnected" in marker
-                or "ConnectionClosed" in marker
-                or websocket.client_state.name == "DISCONNECTED"
-            )
-            if disconnected:
+            if _is_ws_disconnect(websocket, exc):
                 logger.info("Client disconnected while streaming %s", agent)
                 raise ClientStreamClosed() from exc
             logger.exception("Streaming failed for %s", agent)
             _write_debug_trace(
                 "stream_exception",
-                {
+                lambda: {
                     "agent": agent,
                     "mode": mode,
                     "round": round_number,
@@ -2221,10 +3486,20 @@ async def _stream_agent_response(
             except ClientStreamClosed:
                 logger.info("Skipped error send because websocket already closed")
             raise
+    finally:
+        marker_stream.close()
+        if response_stream is not None:
+            # Release the pooled connection even when the stream was abandoned mid-response.
+            try:
+                await response_stream.aclose()
+            except Exception:
+                logger.debug("Failed to close %s response stream", agent, exc_info=True)
+        if holds_gemini_slot:
+            _GEMINI_SEM.release()
 
     _write_debug_trace(
         "stream_complete",
-        {
+        lambda: {
             "agent": agent,
             "mode": mode,
             "round": round_number,
@@ -2250,6 +3525,8 @@ async def _stream_agent_response(
         )
 
     generation_mode = "stream"
+    # Frames held back so a non-streamed turn reaches the client as one batch frame.
+    deferred_frames: List[Dict[str, Any]] = []
     if not full_text.strip():
         generation_mode = "structured_retry"
         logger.warning("Empty stream text for %s; retrying once with structured JSON call.", agent)
@@ -2262,41 +3539,29 @@ async def _stream_agent_response(
                 "message_id": message_id,
             },
         )
-        retry_payload = _retry_with_structured_json(
+        retry_payload = await _retry_with_structured_json(
             client=client,
             model_name=model_name,
             agent=agent,
             retry_context_prompt=retry_context_prompt,
             student_persona=student_persona,
         )
-        retry_message = str(retry_payload.get("message", "")).strip()
-        if not retry_message:
-            retry_message = (
-                "I am still evaluating this. Please share your top concern so I can respond precisely."
-                if agent == "student"
-                else "Could you share your top concern so I can address it directly?"
-            )
-        retry_thought = str(retry_payload.get("internal_thought", "")).strip() or "No internal thought captured"
-        retry_intent = str(retry_payload.get("intent", "")).strip() or "No Intent detected"
-        retry_emotion = str(retry_payload.get("emotional_state", "")).strip() or "calm"
-        retry_stats = retry_payload.get("updated_stats", {})
-        if not isinstance(retry_stats, dict):
-            retry_stats = {}
-
+        retry_fields = _fields_from_retry_payload(retry_payload, agent)
+        # Framed only for the client's stream_chunk; fields are taken from the payload, not re-parsed.
         if agent == "student":
             full_text = (
-                f"<thought>{retry_thought}</thought>\n"
-                f"<stats>{json.dumps(retry_stats, ensure_ascii=False)}</stats>\n"
-                f"<message>{retry_message}</message>\n"
-                f"<emotional_state>{retry_emotion}</emotional_state>\n"
-                f"<intent>{retry_intent}</intent>"
+                f"<thought>{retry_fields['internal_thought']}</thought>\n"
+                f"<stats>{_to_json_text(retry_fields['updated_stats'])}</stats>\n"
+                f"<message>{retry_fields['message']}</message>\n"
+                f"<emotional_state>{retry_fields['emotional_state']}</emotional_state>\n"
+                f"<intent>{retry_fields['intent']}</intent>"
             )
         else:
-            full_text = retry_message
+            full_text = retry_fields["message"]
 
         _write_debug_trace(
             "nonstream_retry_complete",
-            {
+            lambda: {
                 "agent": agent,
                 "mode": mode,
                 "round": round_number,
@@ -2307,10 +3572,11 @@ async def _stream_agent_response(
             },
         )
         if full_text.strip():
-            await _ws_send_json(
-                websocket,
-                {"type": "stream_chunk", "data": {"agent": agent, "text": full_text, "message_id": message_id}},
-            )
+            retry_chunk = {"type": "stream_chunk", "data": {"agent": agent, "text": full_text, "message_id": message_id}}
+            if demo_mode:
+                await _ws_send_json(websocket, retry_chunk)
+            else:
+                deferred_frames.append(retry_chunk)
         if not full_text.strip():
             generation_mode = "fallback"
             finish_reasons = ["structured_json_retry_empty"]
@@ -2326,12 +3592,18 @@ async def _stream_agent_response(
             )
             full_text = "<message>...</message>"
 
-    fields = _extract_response_fields(full_text)
+    if generation_mode == "structured_retry":
+        fields = retry_fields
+    else:
+        fields = _extract_response_fields(
+            full_text,
+            marker_stream.positions if generation_mode == "stream" else None,
+        )
     if agent == "counsellor":
         fields["message"] = _extract_counsellor_message(full_text)
     _write_debug_trace(
         "parse_result",
-        {
+        lambda: {
             "agent": agent,
             "mode": mode,
             "round": round_number,
@@ -2346,7 +3618,7 @@ async def _stream_agent_response(
     if _looks_truncated_message(fields.get("message", "")):
         _write_debug_trace(
             "message_truncated_heuristic",
-            {
+            lambda: {
                 "agent": agent,
                 "mode": mode,
                 "round": round_number,
@@ -2359,7 +3631,7 @@ async def _stream_agent_response(
         fields["message"] = "..."
         _write_debug_trace(
             "parse_message_fallback",
-            {
+            lambda: {
                 "agent": agent,
                 "mode": mode,
                 "round": round_number,
@@ -2367,9 +3639,10 @@ async def _stream_agent_response(
                 "raw_head": _truncate_trace_text(full_text, 260),
             },
         )
-    merged_state = dict(student_inner_state or {})
+    # _merge_student_inner_state builds a fresh dict, so only the student path needs one.
+    merged_state = student_inner_state or {}
     if agent == "student":
-        merged_state = _merge_student_inner_state(merged_state or {}, fields.get("updated_stats", {}))
+        merged_state = _merge_student_inner_state(merged_state, fields.get("updated_stats", {}))
 
     msg = {
         "id": message_id,
@@ -2386,9 +3659,9 @@ async def _stream_agent_response(
         "timestamp": datetime.now().isoformat(),
         "generation_mode": generation_mode,
     }
+    terminal_frames: List[Dict[str, Any]] = []
     if agent == "student" and fields.get("internal_thought"):
-        await _ws_send_json(
-            websocket,
+        terminal_frames.append(
             {
                 "type": "student_thought",
                 "data": {
@@ -2397,28 +3670,51 @@ async def _stream_agent_response(
                     "thought": fields["internal_thought"],
                     "updated_stats": merged_state,
                 },
-            },
+            }
         )
-    await _ws_send_json(websocket, {"type": "intent_update", "data": {"agent": agent, "intent": fields["intent"]}})
-    await _ws_send_json(websocket, {"type": "message_complete", "data": msg})
+    terminal_frames.append({"type": "intent_update", "data": {"agent": agent, "intent": fields["intent"]}})
+    terminal_frames.append({"type": "message_complete", "data": msg})
+    if generation_mode != "stream" and not demo_mode:
+        await _ws_send_batch(websocket, deferred_frames + terminal_frames)
+    else:
+        for frame in terminal_frames:
+            await _ws_send_json(websocket, frame)
     return msg
 
 
 async def _ws_send_json(websocket: WebSocket, payload: Dict[str, Any]) -> None:
+    # Same compact, non-ASCII-escaped text frame as WebSocket.send_json, encoded by orjson.
+    await _ws_send_frame(websocket, _to_json_text(payload))
+
+
+async def _ws_send_batch(websocket: WebSocket, payloads: List[Dict[str, Any]]) -> None:
+    # One frame for several events; the client unpacks "batch" and handles each payload in order.
+    await _ws_send_json(websocket, {"type": "batch", "data": payloads})
+
+
+async def _ws_send_frame(websocket: WebSocket, frame: str) -> None:
+    # Text frames only: the browser client JSON.parses event.data, which would be a Blob for binary frames.
     try:
-        await websocket.send_json(payload)
+        await websocket.send_text(frame)
     except Exception as exc:
-        marker = f"{type(exc).__name__}: {exc}"
-        disconnected = (
-            "ClientDisconnected" in marker
-            or "ConnectionClosed" in marker
-            or websocket.client_state.name == "DISCONNECTED"
-        )
-        if disconnected:
+        if _is_ws_disconnect(websocket, exc):
             raise ClientStreamClosed() from exc
         raise
 
 
+def _is_ws_disconnect(websocket: WebSocket, exc: BaseException) -> bool:
+    return isinstance(exc, _WS_DISCONNECT_ERRORS) or websocket.client_state.name == "DISCONNECTED"
+
+
+_DISCOUNT_AMOUNT_RE = re.compile(r"discount\s*(?:of|up\s*to)?\s*(?:\u20b9|inr|rs\.?)?\s*([0-9][0-9,]{3,10})")
+# Substring cues, matched against lowercased text ("prices" counts as "price").
+_PRICE_REFERENCE_PHRASES = ("the price of", "listed price", "original price", "price for the", "reduction of")
+_OBJECTION_TOKENS = ("price", "cost", "risk", "uncertain", "expensive", "time", "trust", "proof")
+_PRICE_CONCERN_TOKENS = ("price", "fee", "cost", "expensive", "refund")
+_JOB_CONCERN_TOKENS = ("placement", "job", "package", "guarantee")
+_TIME_CONCERN_TOKENS = ("time", "hours", "attendance", "effort")
+
+
 def _update_metrics(state: NegotiationState, counsellor_msg: Dict[str, Any], student_msg: Dict[str, Any]) -> None:
     metrics = state["negotiation_metrics"]
     prev_offer = state["counsellor_position"]["current_offer"]
@@ -2427,10 +3723,10 @@ def _update_metrics(state: NegotiationState, counsellor_msg: Dict[str, Any], stu
     # --- Specialist (Counsellor) Concession Logic ---
     coun_offer = prev_offer
     counsellor_text = counsellor_msg["content"].lower()
-    coun_candidates = _extract_all_offer_candidates(counsellor_text)
+    coun_candidates = _extract_all_offer_candidates_lc(counsellor_text)
     
     # Also detect "discount of X" and apply as relative reduction
-    discount_match = re.search(r"discount\s*(?:of|up\s*to)?\s*(?:\u20b9|inr|rs\.?)?\s*([0-9][0-9,]{3,10})", counsellor_text)
+    discount_match = _DISCOUNT_AMOUNT_RE.search(counsellor_text)
     if discount_match:
         try:
             d_val = int(discount_match.group(1).replace(",", ""))
@@ -2441,26 +3737,23 @@ def _update_metrics(state: NegotiationState, counsellor_msg: Dict[str, Any], stu
 
     if coun_candidates:
         floor = state["counsellor_position"]["floor_offer"]
-        valid_coun = [c for c in coun_candidates if floor <= c <= prev_offer]
-        if valid_coun:
-            best_c = min(valid_coun)
-            # Only count as concession if they aren't just quoting the student's current bid
-            if best_c != prev_student_offer:
-                coun_offer = best_c
+        best_c = min((c for c in coun_candidates if floor <= c <= prev_offer), default=None)
+        # Only count as concession if they aren't just quoting the student's current bid
+        if best_c is not None and best_c != prev_student_offer:
+            coun_offer = best_c
 
     # --- Customer (Student) Concession Logic ---
     stu_offer = prev_student_offer
     student_text = student_msg["content"].lower()
-    stu_candidates = _extract_all_offer_candidates(student_text)
+    stu_candidates = _extract_all_offer_candidates_lc(student_text)
     
     if stu_candidates:
         budget = state["student_position"]["budget"]
-        valid_stu = [c for c in stu_candidates if prev_student_offer <= c <= budget]
-        if valid_stu:
-            candidate_bid = max(valid_stu)
+        candidate_bid = max((c for c in stu_candidates if prev_student_offer <= c <= budget), default=None)
+        if candidate_bid is not None:
             # If they mention the EXACT current offer of the specialist, 
             # check if it's an agreement or just a reference.
-            is_referencing = any(ref in student_text for ref in ["the price of", "listed price", "original price", "price for the", "reduction of"])
+            is_referencing = any(ref in student_text for ref in _PRICE_REFERENCE_PHRASES)
             if candidate_bid == prev_offer and is_referencing:
                 pass
             else:
@@ -2479,7 +3772,7 @@ def _update_metrics(state: NegotiationState, counsellor_msg: Dict[str, Any], stu
     target = state["counsellor_position"]["target_offer"]
     floor = state["counsellor_position"]["floor_offer"]
     margin = max(1, target - floor)
-    metrics["concession_score"] = int(100 * (target - coun_offer) / margin)
+    metrics["concession_score"] = (100 * (target - coun_offer)) // margin
     metrics["concession_score"] = min(100, max(0, metrics["concession_score"]))
 
     emotional = (student_msg.get("emotional_state") or "calm").lower()
@@ -2490,21 +3783,19 @@ def _update_metrics(state: NegotiationState, counsellor_msg: Dict[str, Any], stu
         metrics["trust_index"] = min(100, metrics["trust_index"] + 5)
         metrics["tone_escalation"] = max(0, metrics["tone_escalation"] - 4)
 
-    objections_text = " ".join(state["persona"].get("primary_objections", [])) + " " + student_msg["content"]
-    objection_hits = sum(
-        1
-        for token in ["price", "cost", "risk", "uncertain", "expensive", "time", "trust", "proof"]
-        if token in objections_text.lower()
-    )
+    objections_lc = state.get("primary_objections_lc")
+    if objections_lc is None:
+        objections_lc = " ".join(state["persona"].get("primary_objections", [])).lower()
+    objections_text = f"{objections_lc} {student_text}"
+    objection_hits = sum(1 for token in _OBJECTION_TOKENS if token in objections_text)
     metrics["objection_intensity"] = min(100, max(0, metrics["objection_intensity"] + (objection_hits - 2) * 2))
     inner = state.get("student_inner_state", {})
-    student_text = (student_msg.get("content") or "").lower()
     unresolved = set(inner.get("unresolved_concerns", []))
-    if any(token in student_text for token in ["price", "fee", "cost", "expensive", "refund"]):
+    if any(token in student_text for token in _PRICE_CONCERN_TOKENS):
         unresolved.add("Price")
-    if any(token in student_text for token in ["placement", "job", "package", "guarantee"]):
+    if any(token in student_text for token in _JOB_CONCERN_TOKENS):
         unresolved.add("Job Guarantee")
-    if any(token in student_text for token in ["time", "hours", "attendance", "effort"]):
+    if any(token in student_text for token in _TIME_CONCERN_TOKENS):
         unresolved.add("Effort/Time")
     inner["unresolved_concerns"] = sorted(unresolved)
     if emotional in {"frustrated", "confused"}:
@@ -2514,22 +3805,23 @@ def _update_metrics(state: NegotiationState, counsellor_msg: Dict[str, Any], stu
 
     metrics["objection_intensity"] = min(
         100,
-        int(
-            (metrics["objection_intensity"] * 0.7)
-            + (inner.get("skepticism_level", 50) * 0.2)
-            + (state["persona"].get("confusion_level", 40) * 0.1)
-        ),
+        (
+            metrics["objection_intensity"] * 70
+            + inner.get("skepticism_level", 50) * 20
+            + state["persona"].get("confusion_level", 40) * 10
+        )
+        // 100,
     )
-    metrics["trust_index"] = min(100, max(0, int((metrics["trust_index"] * 0.75) + (inner.get("trust_score", 50) * 0.25))))
+    metrics["trust_index"] = min(100, max(0, (metrics["trust_index"] * 75 + inner.get("trust_score", 50) * 25) // 100))
     retry_modifier = int(metrics.get("retry_modifier", 0))
     trust_score = min(100, metrics["trust_index"] + (retry_modifier // 2))
     willingness = min(100, int(state["persona"].get("willingness_to_invest_score", 50)) + retry_modifier)
-    metrics["close_probability"] = int(
-        (trust_score * 0.35)
-        + ((100 - metrics["objection_intensity"]) * 0.25)
-        + ((100 - metrics["tone_escalation"]) * 0.15)
-        + (willingness * 0.25)
-    )
+    metrics["close_probability"] = (
+        trust_score * 35
+        + (100 - metrics["objection_intensity"]) * 25
+        + (100 - metrics["tone_escalation"]) * 15
+        + willingness * 25
+    ) // 100
     metrics["sentiment_indicator"] = "negative" if emotional in {"frustrated", "confused"} else "positive"
 
 
@@ -2544,14 +3836,8 @@ def _decide_outcome_from_judge(state: NegotiationState, analysis: Dict[str, Any]
     return "failed"
 
 
-async def _judge_outcome(state: NegotiationState) -> Dict[str, Any]:
-    client, _, judge_model_name = get_client_and_models()
-    transcript = "\n\n".join(
-        f"Round {m['round']} {m['agent'].upper()}: {m['content']}" for m in state["messages"]
-    )
-    
-    archetype_id = str(state.get("persona", {}).get("archetype_id", "")).strip().lower()
-    if archetype_id in ["car_buyer", "discount_hunter"]:
+def _judge_static_prompt(product: bool) -> str:
+    if product:
         evaluator_role = "expert automotive sales auditor and retail experience evaluator"
         interaction_type = "automotive sales consultation transcript"
         metrics_focus = "Purchase likelihood (intent to book or test-drive)"
@@ -2574,7 +3860,7 @@ async def _judge_outcome(state: NegotiationState) -> Dict[str, Any]:
         - Look for signals of 'Learning Confidence' vs 'Academic/Career Anxiety'.
         """
 
-    prompt = f"""
+    return f"""
 You are an {evaluator_role}.
 
 Analyze the full {interaction_type}.
@@ -2598,8 +3884,24 @@ EVALUATION RULES:
 Return structured function output only.
 Call the function with the final structured verdict.
 
-METRICS_SNAPSHOT:
-{json.dumps(state['negotiation_metrics'])}
+"""
+
+
+# The judge preamble only varies by product vs programme archetype, so both variants are built once.
+JUDGE_STATIC_PROMPTS: Dict[bool, str] = {product: _judge_static_prompt(product) for product in (False, True)}
+
+
+async def _judge_outcome(state: NegotiationState) -> Dict[str, Any]:
+    client, _, judge_model_name = get_client_and_models()
+    judge_lines = state.get("judge_transcript_lines")
+    if judge_lines is None:
+        judge_lines = [_judge_transcript_line(m) for m in state["messages"]]
+    transcript = "\n\n".join(judge_lines)
+    
+    archetype_id = _state_archetype_lc(state)
+    static_prompt = JUDGE_STATIC_PROMPTS[archetype_id in PRODUCT_ARCHETYPE_IDS]
+    dynamic_prompt = f"""METRICS_SNAPSHOT:
+{_to_json_text(state['negotiation_metrics'])}
 
 DEAL_STATUS:
 {state['deal_status']}
@@ -2607,10 +3909,11 @@ DEAL_STATUS:
 TRANSCRIPT:
 {transcript}
 """
-    parsed = _call_function_json(
+    parsed = await _acall_function_json(
         client=client,
         model_name=judge_model_name,
-        prompt=prompt,
+        prompt=dynamic_prompt,
+        static_prefix=static_prompt,
         function_name="set_negotiation_judgement",
         function_description="Return structured judgement for a negotiation run.",
         parameters_schema={
@@ -2656,6 +3959,9 @@ TRANSCRIPT:
             "skill_recommendations": [],
         },
     )
+    # Round once here; the UI shows one decimal (whole values stay ints) and downstream uses truncate with int().
+    likelihood = round(float(parsed.get("enrollment_likelihood") or 0), 1)
+    parsed["enrollment_likelihood"] = int(likelihood) if likelihood.is_integer() else likelihood
 
     # Calculate Negotiation Score via math formula instead of LLM
     # Win Probability (40%) + Trust Index (30%) + (100 - Concession Score) (30%)
@@ -2667,11 +3973,7 @@ TRANSCRIPT:
     final_trust = max(0, min(100, metrics.get("trust_index", 50) + int(parsed.get("trust_delta", 0))))
     concession_score = metrics.get("concession_score", 0)
 
-    base_score = int(
-        (final_win_prob * 0.4)
-        + (final_trust * 0.3)
-        + ((100 - concession_score) * 0.3)
-    )
+    base_score = (final_win_prob * 40 + final_trust * 30 + (100 - concession_score) * 30) // 100
     
     # Bonus for winner status
     winner = str(parsed.get("winner", "")).lower()
@@ -2683,8 +3985,8 @@ TRANSCRIPT:
 
 @app.post("/auth/login", response_model=LoginResponse)
 async def auth_login(payload: LoginRequest) -> LoginResponse:
-    supplied_hash = _sha256_hex(payload.password)
-    if not hmac.compare_digest(supplied_hash, PASSWORD_SHA256):
+    supplied_digest = hashlib.sha256(payload.password.encode("utf-8")).digest()
+    if not hmac.compare_digest(supplied_digest, PASSWORD_SHA256_DIGEST):
         raise HTTPException(status_code=401, detail="Unauthorized: invalid password")
     token = _issue_auth_token()
     return LoginResponse(token=token, expires_in=AUTH_TOKEN_TTL_SECONDS)
@@ -2695,10 +3997,10 @@ async def analyze_url(payload: AnalyzeUrlRequest) -> AnalyzeUrlResponse:
     _require_auth_token(payload.auth_token)
     url = str(payload.url)
     archetype_id = payload.archetype_id
-    program, source = _analyze_program(url, archetype_id=archetype_id)
+    program, source = await _analyze_program(url, archetype_id=archetype_id)
     program = _to_plain_json(program)
     forced_archetype_id = _resolve_selected_archetype(archetype_id)
-    persona = _generate_persona(program, forced_archetype_id=forced_archetype_id)
+    persona = await _generate_persona(program, forced_archetype_id=forced_archetype_id)
     persona = _to_plain_json(persona)
     session_id = str(uuid.uuid4())
     SESSION_STORE[session_id] = {
@@ -2714,6 +4016,7 @@ async def analyze_url(payload: AnalyzeUrlRequest) -> AnalyzeUrlResponse:
 @app.websocket("/negotiate")
 async def negotiate_websocket(websocket: WebSocket) -> None:
     await websocket.accept()
+    speculation: Optional[_SpeculativeStream] = None
     try:
         raw_config = await websocket.receive_json()
         config = NegotiationConfig(**raw_config)
@@ -2727,7 +4030,7 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
         persona = session["persona"]
         if not _is_valid_student_persona_schema(persona):
             logger.warning("Session %s had legacy persona schema. Regenerating StudentPersona.", config.session_id)
-            persona = _to_plain_json(_generate_persona(program))
+            persona = _to_plain_json(await _generate_persona(program))
             session["persona"] = persona
         mode = str(config.mode or "ai_vs_ai").strip().lower()
         if mode not in {"ai_vs_ai", "human_vs_ai", "agent_powered_human_vs_ai"}:
@@ -2738,10 +4041,11 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
         if forced_archetype_id in ARCHETYPE_CONFIGS:
             current_archetype = str(persona.get("archetype_id", "")).strip()
             if current_archetype != forced_archetype_id:
-                persona = _to_plain_json(_generate_persona(program, forced_archetype_id=forced_archetype_id))
+                persona = _to_plain_json(await _generate_persona(program, forced_archetype_id=forced_archetype_id))
                 session["persona"] = persona
+        archetype_id_lc = str(persona.get("archetype_id", "")).strip().lower()
         if mode in {"human_vs_ai", "agent_powered_human_vs_ai"}:
-            if str(persona.get("archetype_id", "")).strip().lower() == "skeptical_shopper":
+            if archetype_id_lc == "skeptical_shopper":
                 persona["language_style"] = "Hindi"
             else:
                 persona["language_style"] = "UK English"
@@ -2796,6 +4100,11 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
                 "retry_modifier": retry_modifier,
             },
             "retry_context": retry_context,
+            "prompt_headers": {},
+            "transcript_tail": deque(maxlen=TRANSCRIPT_TAIL_MAX_LINES),
+            "judge_transcript_lines": [],
+            "primary_objections_lc": " ".join(persona.get("primary_objections", [])).lower(),
+            "archetype_id_lc": archetype_id_lc,
         }
 
         await _ws_send_json(
@@ -2854,21 +4163,43 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
                 await _ws_send_json(websocket, {"type": "message_complete", "data": counsellor_msg})
             else:
                 counsellor_id = str(uuid.uuid4())
+                counsellor_prompt = _build_counsellor_prompt(state)
+                prefetched_stream = None
+                if speculation is not None:
+                    prefetched_stream = await speculation.claim(counsellor_prompt)
+                    speculation = None
                 counsellor_msg = await _stream_agent_response(
                     websocket,
                     client,
                     negotiation_model_name,
-                    _build_counsellor_prompt(state),
+                    counsellor_prompt,
                     "counsellor",
                     state["round"],
                     counsellor_id,
                     config.demo_mode,
                     _build_retry_context_prompt(state),
                     mode=mode,
+                    prefetched_stream=prefetched_stream,
                 )
-            state["messages"].append(counsellor_msg)
-            state["history_for_reporting"].append(counsellor_msg)
-
+            _append_turn(state, counsellor_msg, counsellor_msg)
+
+            def _speculate_next_counsellor(partial_text: str) -> None:
+                # The student's message is final once its tag closes, so the next counsellor prompt can be
+                # built now. claim() only uses the stream if the real prompt comes out identical.
+                nonlocal speculation
+                content = _extract_response_fields(partial_text)["message"] or "..."
+                speculative_state = dict(state)
+                speculative_state["messages"] = [*state["messages"], {"agent": "student", "content": content}]
+                speculative_state["transcript_tail"] = deque(state["transcript_tail"], maxlen=TRANSCRIPT_TAIL_MAX_LINES)
+                speculative_state["transcript_tail"].append(_transcript_line({"agent": "student", "content": content}))
+                speculation = _SpeculativeStream(client, negotiation_model_name, _build_counsellor_prompt(speculative_state))
+
+            speculate = (
+                SPECULATIVE_COUNSELLOR_PREFETCH
+                and mode == "ai_vs_ai"
+                and speculation is None
+                and state["round"] < state["max_rounds"]
+            )
             student_id = str(uuid.uuid4())
             student_msg = await _stream_agent_response(
                 websocket,
@@ -2883,6 +4214,7 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
                 mode=mode,
                 student_inner_state=state["student_inner_state"],
                 student_persona=state["persona"],
+                on_message_closed=_speculate_next_counsellor if speculate else None,
             )
             if str(student_msg.get("generation_mode", "stream")) == "stream":
                 student_generation_failures = 0
@@ -2918,8 +4250,7 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
             spoken_student_msg["internal_thought"] = ""
             spoken_student_msg["updated_stats"] = {}
             spoken_student_msg["updated_state"] = {}
-            state["messages"].append(spoken_student_msg)
-            state["history_for_reporting"].append(student_msg)
+            _append_turn(state, spoken_student_msg, student_msg)
 
             if mode == "agent_powered_human_vs_ai":
                 current_round = int(state["round"])
@@ -2948,7 +4279,7 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
                     except Exception as copilot_exc:
                         _write_debug_trace(
                             "copilot_dispatch_failed",
-                            {
+                            lambda: {
                                 "mode": mode,
                                 "round": current_round,
                                 "error_type": type(copilot_exc).__name__,
@@ -2961,41 +4292,49 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
                 task.add_done_callback(background_tasks.discard)
 
             _update_metrics(state, counsellor_msg, spoken_student_msg)
-            state["negotiation_metrics"]["round"] = state["round"]
-            state["negotiation_metrics"]["max_rounds"] = state["max_rounds"]
+            metrics = state["negotiation_metrics"]
+            metrics["round"] = state["round"]
+            metrics["max_rounds"] = state["max_rounds"]
 
-            await _ws_send_json(
+            # End-of-round state and metrics always travel together, so they go out as one frame.
+            await _ws_send_batch(
                 websocket,
-                {
-                    "type": "state_update",
-                    "data": {
-                        "round": state["round"],
-                        "max_rounds": state["max_rounds"],
-                        "deal_status": state["deal_status"],
-                        "counsellor_offer": state["counsellor_position"]["current_offer"],
-                        "student_offer": state["student_position"]["current_offer"],
-                        "student_inner_state": state["student_inner_state"],
+                [
+                    {
+                        "type": "state_update",
+                        "data": {
+                            "round": metrics["round"],
+                            "max_rounds": metrics["max_rounds"],
+                            "deal_status": state["deal_status"],
+                            "counsellor_offer": state["counsellor_position"]["current_offer"],
+                            "student_offer": state["student_position"]["current_offer"],
+                            "student_inner_state": state["student_inner_state"],
+                        },
                     },
-                },
+                    {"type": "metrics_update", "data": metrics},
+                ],
             )
-            await _ws_send_json(websocket, {"type": "metrics_update", "data": state["negotiation_metrics"]})
 
             state["round"] += 1
-            if config.demo_mode:
+            if config.demo_mode and NEGOTIATION_DEMO_PACING:
                 await asyncio.sleep(0.6)
 
+        if speculation is not None:
+            await speculation.discard()
+            speculation = None
         analysis = await _judge_outcome(state)
         # Sync live state with judge analysis to ensure UI consistency
+        metrics = state["negotiation_metrics"]
         if "enrollment_likelihood" in analysis:
-            state["negotiation_metrics"]["close_probability"] = int(analysis["enrollment_likelihood"])
+            metrics["close_probability"] = int(analysis["enrollment_likelihood"])
         
-        baseline_trust = 50 + state["negotiation_metrics"]["retry_modifier"]
+        baseline_trust = 50 + metrics["retry_modifier"]
         if "trust_delta" in analysis:
             new_trust_index = baseline_trust + int(analysis["trust_delta"])
-            state["negotiation_metrics"]["trust_index"] = max(0, min(100, new_trust_index))
+            metrics["trust_index"] = max(0, min(100, new_trust_index))
 
         # Push final synced metrics to frontend (updates bottom ribbon)
-        await _ws_send_json(websocket, {"type": "metrics_update", "data": state["negotiation_metrics"]})
+        await _ws_send_json(websocket, {"type": "metrics_update", "data": metrics})
 
         state["deal_status"] = _decide_outcome_from_judge(state, analysis)
         await _ws_send_json(
@@ -3006,7 +4345,7 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
                     "result": state["deal_status"],
                     "winner": analysis.get("winner", "no-deal"),
                     "judge": analysis,
-                    "final_metrics": state["negotiation_metrics"],
+                    "final_metrics": metrics,
                     "final_offers": {
                         "counsellor": state["counsellor_position"]["current_offer"],
                         "student": state["student_position"]["current_offer"],
@@ -3026,13 +4365,15 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
         _emit_conversation_traceability(config.session_id, state, analysis)
         if _is_rag_pipeline_enabled():
             trace_payload = _build_traceability_payload(config.session_id, state, analysis)
-            asyncio.create_task(
+            task = asyncio.create_task(
                 _run_post_session_jobs_safe(
                     session_id=config.session_id,
                     mode=mode,
                     trace_payload=trace_payload,
                 )
             )
+            POST_SESSION_TASKS.add(task)
+            task.add_done_callback(POST_SESSION_TASKS.discard)
         else:
             _write_debug_trace(
                 "post_session_jobs_skipped",
@@ -3061,17 +4402,52 @@ async def negotiate_websocket(websocket: WebSocket) -> None:
             await _ws_send_json(websocket, {"type": "error", "data": {"message": str(exc)}})
         except ClientStreamClosed:
             logger.info("Skipped error send because websocket already closed")
+    finally:
+        if speculation is not None:
+            await speculation.discard()
+
+
+
+_MESSAGE_TAG_RE = re.compile(r"</?message>", re.IGNORECASE)
+
+
+# Field lines and non-message tag lines dropped by the line-by-line fallback below.
+_TRANSCRIPT_SKIP_PREFIXES = (
+    "INTERNAL_THOUGHT:",
+    "UPDATED_STATS:",
+    "UPDATED_STATE:",
+    "EMOTIONAL_STATE:",
+    "STRATEGIC_INTENT:",
+    "TECHNIQUES_USED:",
+    "<THOUGHT>",
+    "</THOUGHT>",
+    "<STATS>",
+    "</STATS>",
+    "<INTENT>",
+    "</INTENT>",
+    "<EMOTIONAL_STATE>",
+    "</EMOTIONAL_STATE>",
+)
+
 
+def _parse_message_timestamp(msg: Optional[Dict[str, Any]]) -> Optional[datetime]:
+    ts = str((msg or {}).get("timestamp", "")).strip()
+    if not ts:
+        return None
+    try:
+        return datetime.fromisoformat(ts)
+    except Exception:
+        return None
 
 
 def _clean_transcript_content(content: str) -> str:
     # 1. XML Block Match
-    xml_match = re.search(r"<message>\s*(.*?)\s*</message>", content, re.IGNORECASE | re.DOTALL)
+    xml_match = _TAG_BLOCK_RES["message"][0].search(content)
     if xml_match:
         return xml_match.group(1).strip()
     
     # 2. Inline prefix Match
-    inline_match = re.search(r"MESSAGE:\s*(.*?)(?:(?:\n|\r|\s)(?:INTERNAL_THOUGHT|UPDATED_STATS|UPDATED_STATE|EMOTIONAL_STATE|STRATEGIC_INTENT|TECHNIQUES_USED|CONFIDENCE_SCORE)\s*:|$)", content, re.IGNORECASE | re.DOTALL)
+    inline_match = _MESSAGE_BLOCK_RE.search(content)
     if inline_match:
         return inline_match.group(1).strip()
 
@@ -3082,20 +4458,12 @@ def _clean_transcript_content(content: str) -> str:
         if not line: 
             continue
         upper = line.upper()
-        if any(upper.startswith(p) for p in ["INTERNAL_THOUGHT:", "UPDATED_STATS:", "UPDATED_STATE:", "EMOTIONAL_STATE:", "STRATEGIC_INTENT:", "TECHNIQUES_USED:"]):
-            continue
-        if upper.startswith("<THOUGHT>") or upper.startswith("</THOUGHT>"):
-            continue
-        if upper.startswith("<STATS>") or upper.startswith("</STATS>"):
-            continue
-        if upper.startswith("<INTENT>") or upper.startswith("</INTENT>"):
-            continue
-        if upper.startswith("<EMOTIONAL_STATE>") or upper.startswith("</EMOTIONAL_STATE>"):
+        if upper.startswith(_TRANSCRIPT_SKIP_PREFIXES):
             continue
             
         # Handle <message> tags on single lines
-        if upper.startswith("<MESSAGE>") or upper.startswith("</MESSAGE>"):
-            clean = re.sub(r"</?message>", "", line, flags=re.IGNORECASE).strip()
+        if upper.startswith(("<MESSAGE>", "</MESSAGE>")):
+            clean = _MESSAGE_TAG_RE.sub("", line).strip()
             if clean:
                 lines.append(clean)
             continue
@@ -3112,70 +4480,20 @@ def _clean_transcript_content(content: str) -> str:
     return " ".join(lines).strip()
 
 
-@app.post("/generate-report")
-async def generate_report(payload: ReportRequest) -> StreamingResponse:
-    _require_auth_token(payload.auth_token)
-    session = SESSION_STORE.get(payload.session_id, {})
-    program = session.get("program", {})
-    persona = session.get("persona", {})
-    session_last_run = session.get("last_run", {})
-
-    buf = BytesIO()
-    doc = SimpleDocTemplate(
-        buf,
-        pagesize=letter,
-        title="Program Counsellor Report",
-        leftMargin=30,
-        rightMargin=30,
-        topMargin=26,
-        bottomMargin=26,
-    )
-    styles = getSampleStyleSheet()
-    story: List[Any] = []
-    hindi_font_name, _ = _configure_pdf_fonts()
-    archetype_id = str(persona.get("archetype_id", "")).strip().lower()
-    use_hindi_transcript = archetype_id == "skeptical_shopper"
-
-    judge = payload.analysis or {}
-    winner = str(judge.get("winner", "no-deal"))
-    commitment = str(judge.get("commitment_signal", "none"))
-    duration_seconds = 0
-    if isinstance(payload.analysis, dict):
-        try:
-            duration_seconds = int(float(payload.analysis.get("duration_seconds", 0)))
-        except Exception:
-            duration_seconds = 0
-    duration_hms = ""
-    if isinstance(payload.analysis, dict):
-        duration_hms = str(payload.analysis.get("duration_hms", "")).strip()
+PDF_STYLES: Optional[Dict[str, Optional[ParagraphStyle]]] = None
 
-    if not duration_hms:
-        transcript_with_ts = session_last_run.get("history_for_reporting") or payload.transcript or []
-        timestamps: List[datetime] = []
-        for msg in transcript_with_ts:
-            ts = str((msg or {}).get("timestamp", "")).strip()
-            if not ts:
-                continue
-            try:
-                timestamps.append(datetime.fromisoformat(ts))
-            except Exception:
-                continue
-        if len(timestamps) >= 2:
-            duration_seconds = max(0, int((max(timestamps) - min(timestamps)).total_seconds()))
 
-    if not duration_hms:
-        hours = duration_seconds // 3600
-        minutes = (duration_seconds % 3600) // 60
-        seconds = duration_seconds % 60
-        duration_hms = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+def get_pdf_styles() -> Dict[str, Optional[ParagraphStyle]]:
+    # Report paragraph styles are identical for every build; construct them once per process.
+    global PDF_STYLES
+    if PDF_STYLES is None:
+        PDF_STYLES = _build_pdf_styles()
+    return PDF_STYLES
 
-    commitment_map = {
-        "none": "No Commitment",
-        "soft_commitment": "Exploring Enrollment",
-        "conditional_commitment": "Conditional Yes",
-        "strong_commitment": "Confirmed Enrollment",
-    }
 
+def _build_pdf_styles() -> Dict[str, Optional[ParagraphStyle]]:
+    styles = getSampleStyleSheet()
+    hindi_font_name, _ = _configure_pdf_fonts()
     title_style = ParagraphStyle(
         "ReportTitle",
         parent=styles["Title"],
@@ -3231,7 +4549,7 @@ async def generate_report(payload: ReportRequest) -> StreamingResponse:
     )
     transcript_hindi_style: Optional[ParagraphStyle] = None
     thought_hindi_style: Optional[ParagraphStyle] = None
-    if use_hindi_transcript and hindi_font_name != "Helvetica":
+    if hindi_font_name != "Helvetica":
         transcript_hindi_style = ParagraphStyle(
             "TranscriptHindi",
             parent=body_style,
@@ -3242,6 +4560,90 @@ async def generate_report(payload: ReportRequest) -> StreamingResponse:
             parent=thought_style,
             fontName=hindi_font_name,
         )
+    return {
+        "title": title_style,
+        "subtitle": subtitle_style,
+        "section": section_style,
+        "body": body_style,
+        "meta": meta_style,
+        "thought": thought_style,
+        "transcript_hindi": transcript_hindi_style,
+        "thought_hindi": thought_hindi_style,
+    }
+
+
+def _build_report_pdf_bytes(
+    program: Dict[str, Any],
+    persona: Dict[str, Any],
+    session_last_run: Dict[str, Any],
+    transcript: List[Dict[str, Any]],
+    analysis: Dict[str, Any],
+) -> bytes:
+    buf = BytesIO()
+    doc = SimpleDocTemplate(
+        buf,
+        pagesize=letter,
+        title="Program Counsellor Report",
+        leftMargin=30,
+        rightMargin=30,
+        topMargin=26,
+        bottomMargin=26,
+    )
+    story: List[Any] = []
+    archetype_id = str(persona.get("archetype_id", "")).strip().lower()
+    use_hindi_transcript = archetype_id == "skeptical_shopper"
+
+    judge = analysis or {}
+    winner = str(judge.get("winner", "no-deal"))
+    commitment = str(judge.get("commitment_signal", "none"))
+    duration_seconds = 0
+    if isinstance(analysis, dict):
+        try:
+            duration_seconds = int(float(analysis.get("duration_seconds", 0)))
+        except Exception:
+            duration_seconds = 0
+    duration_hms = ""
+    if isinstance(analysis, dict):
+        duration_hms = str(analysis.get("duration_hms", "")).strip()
+
+    if not duration_hms:
+        transcript_with_ts = session_last_run.get("history_for_reporting") or transcript or []
+        # Messages are stored in order, so only the first and last parseable timestamps are needed.
+        first_index = len(transcript_with_ts)
+        first_ts: Optional[datetime] = None
+        for index, msg in enumerate(transcript_with_ts):
+            first_ts = _parse_message_timestamp(msg)
+            if first_ts is not None:
+                first_index = index
+                break
+        for index in range(len(transcript_with_ts) - 1, first_index, -1):
+            last_ts = _parse_message_timestamp(transcript_with_ts[index])
+            if last_ts is not None:
+                duration_seconds = max(0, int((last_ts - first_ts).total_seconds()))
+                break
+
+    if not duration_hms:
+        hours = duration_seconds // 3600
+        minutes = (duration_seconds % 3600) // 60
+        seconds = duration_seconds % 60
+        duration_hms = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+    commitment_map = {
+        "none": "No Commitment",
+        "soft_commitment": "Exploring Enrollment",
+        "conditional_commitment": "Conditional Yes",
+        "strong_commitment": "Confirmed Enrollment",
+    }
+
+    pdf_styles = get_pdf_styles()
+    title_style = pdf_styles["title"]
+    subtitle_style = pdf_styles["subtitle"]
+    section_style = pdf_styles["section"]
+    body_style = pdf_styles["body"]
+    meta_style = pdf_styles["meta"]
+    thought_style = pdf_styles["thought"]
+    transcript_hindi_style = pdf_styles["transcript_hindi"] if use_hindi_transcript else None
+    thought_hindi_style = pdf_styles["thought_hindi"] if use_hindi_transcript else None
 
     def _paragraph_text(value: Any, allow_breaks: bool = False) -> str:
         safe = xml_escape(str(value or ""))
@@ -3313,7 +4715,7 @@ async def generate_report(payload: ReportRequest) -> StreamingResponse:
     story.append(_make_paragraph(str(judge.get("primary_unresolved_objection", "Not specified")), body_style))
     story.append(Spacer(1, 8))
 
-    run_history = payload.analysis.get("run_history", []) if isinstance(payload.analysis, dict) else []
+    run_history = analysis.get("run_history", []) if isinstance(analysis, dict) else []
     if isinstance(run_history, list) and len(run_history) > 1:
         story.append(_make_paragraph("Performance Progression", section_style))
         progression_rows = [["Run", "Score", "Delta vs Previous", "Delta vs Baseline"]]
@@ -3390,7 +4792,7 @@ async def generate_report(payload: ReportRequest) -> StreamingResponse:
     story.append(Spacer(1, 10))
 
     story.append(_make_paragraph("Transcript", section_style))
-    transcript_for_report = session_last_run.get("history_for_reporting") or payload.transcript
+    transcript_for_report = session_last_run.get("history_for_reporting") or transcript
     for msg in transcript_for_report:
         agent = str(msg.get("agent", "")).upper() or "UNKNOWN"
         rnd = msg.get("round", "-")
@@ -3416,10 +4818,37 @@ async def generate_report(payload: ReportRequest) -> StreamingResponse:
         story.append(Spacer(1, 6))
 
     doc.build(story)
-    buf.seek(0)
+    return buf.getvalue()
+
+
+async def _render_report_pdf(*args: Any) -> bytes:
+    pool = get_pdf_pool()
+    if pool is not None:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, _build_report_pdf_bytes, *args)
+        except (BrokenProcessPool, pickle.PicklingError) as exc:
+            # Workers could not start or import this module; drop the pool and render on a thread instead.
+            logger.warning("PDF worker pool unavailable (%s); rendering report in-process", exc)
+            _shutdown_pdf_pool()
+    return await asyncio.to_thread(_build_report_pdf_bytes, *args)
+
+
+@app.post("/generate-report")
+async def generate_report(payload: ReportRequest) -> Response:
+    _require_auth_token(payload.auth_token)
+    session = SESSION_STORE.get(payload.session_id, {})
+    pdf_bytes = await _render_report_pdf(
+        session.get("program", {}),
+        session.get("persona", {}),
+        session.get("last_run", {}),
+        payload.transcript,
+        payload.analysis,
+    )
     filename = f"Program_Counsellor_Report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    return StreamingResponse(
-        buf,
+    # ReportLab only emits the document on save, so the bytes are complete here; send them as one body
+    # rather than a line-by-line iterator.
+    return Response(
+        pdf_bytes,
         media_type="application/pdf",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -3433,4 +4862,16 @@ async def root() -> Dict[str, str]:
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    try:
+        import uvloop  # noqa: F401
+
+        event_loop = "uvloop"
+    except ImportError:
+        event_loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+
+        http_impl = "httptools"
+    except ImportError:
+        http_impl = "h11"
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop=event_loop, http=http_impl)
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 sys.path.append("/home/priyanshu/Documents/CL/closewire/backend")
 import main
@@ -25,7 +26,7 @@ program = {
     "emi_or_financing_options": "Yes"
 }
 
-persona = main._generate_persona(program, forced_archetype_id="car_buyer")
+persona = asyncio.run(main._generate_persona(program, forced_archetype_id="car_buyer"))
 print("===== PERSONA =====")
 pprint.pprint(persona)
 
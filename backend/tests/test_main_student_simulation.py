@@ -1,6 +1,10 @@
+import asyncio
+import hashlib
 import importlib.util
 import pathlib
+import types
 import unittest
+from unittest import mock
 
 
 def _load_main_module():
@@ -17,6 +21,276 @@ def _load_main_module():
 main = _load_main_module()
 
 
+# Responses paired with what the original regex-only _extract_response_fields returned for them. Every
+# fast path (Hyperscan offsets, streamed offsets, lowercase substring scans) must reproduce these exactly.
+_PARSER_CASES = {
+    "tag_student": (
+        "<thought>He keeps dodging the fee.</thought>\n<message>Sir, what is the EMI option?</message>\n<stats>{\"trust\": 44, \"resistance\": 70}</stats>\n<intent>Probe financing</intent>\n<emotional_state>Anxious</emotional_state>",
+        {
+            "message": "Sir, what is the EMI option?",
+            "techniques": [],
+            "intent": "Probe financing",
+            "confidence_score": 60,
+            "emotional_state": "Anxious",
+            "internal_thought": "He keeps dodging the fee.",
+            "updated_stats": {"trust": 44, "resistance": 70},
+        },
+    ),
+    "tag_counsellor": (
+        "<message>We offer a 12 month EMI plan.</message>\n<techniques>[\"reframing\", \"social_proof\"]</techniques>\n<intent>Lower price anxiety</intent>\n<confidence>88</confidence>",
+        {
+            "message": "We offer a 12 month EMI plan.",
+            "techniques": ["reframing", "social_proof"],
+            "intent": "Lower price anxiety",
+            "confidence_score": 88,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "tag_techniques_csv": (
+        "<message>Fine.</message><techniques>anchoring, scarcity</techniques><confidence_score>140</confidence_score>",
+        {
+            "message": "Fine.",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 100,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "tag_uppercase": (
+        "<MESSAGE>Hello there</MESSAGE><THOUGHT>quiet</THOUGHT><Emotion>curious</Emotion>",
+        {
+            "message": "Hello there",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "curious",
+            "internal_thought": "quiet",
+            "updated_stats": {},
+        },
+    ),
+    "line_student": (
+        "INTERNAL_THOUGHT: Too salesy.\nUPDATED_STATS: {\"trust\": 30}\nMESSAGE: Can you share the refund policy?\nEMOTIONAL_STATE: skeptical\nSTRATEGIC_INTENT: Test credibility.",
+        {
+            "message": "Can you share the refund policy?",
+            "techniques": [],
+            "intent": "Test credibility.",
+            "confidence_score": 60,
+            "emotional_state": "skeptical",
+            "internal_thought": "Too salesy.",
+            "updated_stats": {"trust": 30},
+        },
+    ),
+    "line_counsellor": (
+        "MESSAGE: We support beginners.\nTECHNIQUES_USED: [workload_validation, \"objection_reframing\"]\nSTRATEGIC_INTENT: Build trust.\nCONFIDENCE_SCORE: 84.6",
+        {
+            "message": "We support beginners.",
+            "techniques": ["workload_validation", "objection_reframing"],
+            "intent": "Build trust.",
+            "confidence_score": 84,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "line_updated_state": (
+        "UPDATED_STATE: {\"skepticism_level\": 55}\nMESSAGE: ok then",
+        {
+            "message": "ok then",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {"skepticism_level": 55},
+        },
+    ),
+    "line_lowercase_labels": (
+        "message: lower labels work?\nconfidence_score: 12\nemotional_state: Calm Down",
+        {
+            "message": "lower labels work?",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 12,
+            "emotional_state": "calm down",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "missing_close_message": (
+        "<thought>hmm</thought><message>Hello, this never closes\n<intent>close",
+        {
+            "message": "Hello, this never closes\n<intent>close",
+            "techniques": [],
+            "intent": "close",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "hmm",
+            "updated_stats": {},
+        },
+    ),
+    "missing_close_all": (
+        "<message>only an open tag",
+        {
+            "message": "only an open tag",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "duplicate_message_tags": (
+        "<message>First answer</message>\n<message>Second answer</message>",
+        {
+            "message": "First answer",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "duplicate_thought_tags": (
+        "<thought>one</thought><thought>two</thought><message>m</message>",
+        {
+            "message": "m",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "one",
+            "updated_stats": {},
+        },
+    ),
+    "close_before_open": (
+        "</message> stray <message>Real message</message> </message>",
+        {
+            "message": "Real message",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "duplicate_labels": (
+        "CONFIDENCE_SCORE: n/a\nCONFIDENCE_SCORE: 77\nEMOTIONAL_STATE: 123\nEMOTIONAL_STATE: hopeful\nMESSAGE: twice",
+        {
+            "message": "twice",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 77,
+            "emotional_state": "",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "tags_and_labels": (
+        "<message>Tagged wins</message>\nMESSAGE: label loses\nEMOTIONAL_STATE: excited\nTECHNIQUES_USED: [a, b]",
+        {
+            "message": "Tagged wins",
+            "techniques": ["a", "b"],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "excited",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "stats_label_then_tag_empty": (
+        "<stats></stats>\nUPDATED_STATS: {\"trust\": 12}\nMESSAGE: x",
+        {
+            "message": "x",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {"trust": 12},
+        },
+    ),
+    "invalid_stats": (
+        "<message>m</message><stats>not json</stats>",
+        {
+            "message": "m",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "plain_text": (
+        "Just a plain reply without any structure.",
+        {
+            "message": "Just a plain reply without any structure.",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "scrubbed_unlabeled": (
+        "<thought>internal</thought> Visible reply text here <intent>i</intent>",
+        {
+            "message": "Visible reply text here",
+            "techniques": [],
+            "intent": "i",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "internal",
+            "updated_stats": {},
+        },
+    ),
+    "empty": (
+        "",
+        {
+            "message": "...",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 60,
+            "emotional_state": "calm",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "non_ascii_tags": (
+        "<message>सर, फीस बहुत ज़्यादा है।</message><emotional_state>worried</emotional_state><confidence>70</confidence>",
+        {
+            "message": "सर, फीस बहुत ज़्यादा है।",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 70,
+            "emotional_state": "worried",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+    "non_ascii_labels": (
+        "MESSAGE: Café pricing?\nCONFIDENCE_SCORE: 65\nEMOTIONAL_STATE: curious",
+        {
+            "message": "Café pricing?",
+            "techniques": [],
+            "intent": "",
+            "confidence_score": 65,
+            "emotional_state": "curious",
+            "internal_thought": "",
+            "updated_stats": {},
+        },
+    ),
+}
+
+
 class StudentSimulationParsingTests(unittest.TestCase):
     def test_extract_response_fields_for_student_payload(self):
         text = """
@@ -73,5 +347,284 @@ EMOTIONAL_STATE: skeptical
         self.assertEqual(merged["unresolved_concerns"], ["Job Guarantee"])
 
 
+class ResponseParserDifferentialTests(unittest.TestCase):
+    def _assert_matches_original(self, parse):
+        for name, (text, expected) in _PARSER_CASES.items():
+            with self.subTest(case=name):
+                self.assertEqual(parse(text), expected)
+
+    def test_default_path_matches_original_parser(self):
+        self._assert_matches_original(main._extract_response_fields)
+
+    def test_substring_scan_path_matches_original_parser(self):
+        with mock.patch.object(main, "_RESPONSE_MARKER_DB", None):
+            self._assert_matches_original(main._extract_response_fields)
+
+    def test_precomputed_scan_positions_match_original_parser(self):
+        if main._RESPONSE_MARKER_DB is None:
+            self.skipTest("hyperscan is not installed")
+
+        def parse(text):
+            positions = main._scan_response_markers(text) if text.isascii() else None
+            return main._extract_response_fields(text, positions)
+
+        self._assert_matches_original(parse)
+
+    def test_streamed_positions_match_original_parser(self):
+        if main._RESPONSE_MARKER_STREAM_DB is None:
+            self.skipTest("hyperscan is not installed")
+
+        def parse(text):
+            stream = main._ResponseMarkerStream()
+            for start in range(0, len(text), 7):
+                stream.feed(text[start : start + 7])
+            stream.close()
+            return main._extract_response_fields(text, stream.positions)
+
+        self._assert_matches_original(parse)
+
+
+_HEADER_PROGRAM = {
+    "program_name": "Data $cience ${Pro}",
+    "value_proposition": "Save $200 with the $early bird offer",
+    "target_audience": "Career switchers",
+    "key_features": ["Live $classes", "Mentor support"],
+    "program_fee_inr": "INR 1,20,000",
+    "emi_or_financing_options": "12 month EMI at $0 interest",
+    "positioning_angle": "Outcome focused",
+    "curriculum_modules": ["Python", "SQL"],
+}
+
+
+def _header_state(archetype_id, mode="ai_vs_ai", is_retry=False):
+    persona = {
+        "name": "Aarav",
+        "age": 27,
+        "current_role": "support engineer",
+        "archetype_id": archetype_id,
+        "archetype_label": "Label $x",
+        "city_tier": "Tier-2",
+        "backstory": "Paid $500 for ${course} twice",
+        "hidden_secret": "Owes $$ to family",
+        "misconception": "Thinks $9 courses are equal",
+        "language_style": "Hinglish",
+        "common_vocabulary": ["$$ bills", "yaar"],
+    }
+    return {
+        "program": dict(_HEADER_PROGRAM),
+        "persona": persona,
+        "mode": mode,
+        "retry_context": {"is_retry": is_retry, "mistakes": ["Ignored $ concerns"], "primary_unresolved_objection": "Price"},
+    }
+
+
+def _archetype_header_digest(archetype_id):
+    digest = hashlib.sha256()
+    for mode in main.NEGOTIATION_MODES:
+        for is_retry in (False, True):
+            state = _header_state(archetype_id, mode, is_retry)
+            digest.update(main._static_counsellor_header(state).encode("utf-8") + b"\0")
+            digest.update(main._static_student_header(state).encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+# SHA-256 over both headers for every mode and retry setting of each archetype ("" is an unknown archetype,
+# which takes the default templates). Regenerate with _archetype_header_digest only for intended prompt edits.
+_HEADER_SNAPSHOTS = {
+    "desperate_switcher": "d6a7cbac1c49bfa597b0943f4155511c9322e26bc501245d90265aa9a0e404f7",
+    "skeptical_shopper": "6c5fa0cbbdd5e1928a889acebf52ce2b4dea83c735e45e9f18ba762727a49ee4",
+    "stagnant_pro": "971b46fcf3d2b0681cc7d5622df5317c39e0f7aaabb4b2a21baf2da6d8f22011",
+    "credential_hunter": "31383575d0e666f3f4e2bd1e6991552ef38c8e2a573d48c7bd5dee2ea95b517d",
+    "drifter": "a490c0b2581c96ad9754b02b75d72dd94e7c7b61d212b5ee8b26a8a4377a27e1",
+    "fomo_victim": "47e5f69f8f4a5e8cf3a43607170a3d3b7506f1a3b6dd21e681e8e3c71dfeeceb",
+    "intellectual_buyer": "a473e06fb8102a5bee7f19c03cd6e7c410cd0890d52f318b5b4e460d82a9a617",
+    "car_buyer": "92e8552f4b03e8c2877e4e7755eb344068167bef48ca00de7aa577185877179e",
+    "discount_hunter": "f0ed24fb750f965a02dc4c048e1cdb9050425432027eadbfd95af19cc6a69747",
+    "": "d6a7cbac1c49bfa597b0943f4155511c9322e26bc501245d90265aa9a0e404f7",
+}
+
+
+class PromptHeaderSnapshotTests(unittest.TestCase):
+    def test_headers_match_snapshots(self):
+        self.assertEqual(set(_HEADER_SNAPSHOTS), set(main.ARCHETYPE_IDS) | {""})
+        for archetype_id, expected in _HEADER_SNAPSHOTS.items():
+            with self.subTest(archetype=archetype_id or "<unknown>"):
+                self.assertEqual(_archetype_header_digest(archetype_id), expected)
+
+    def test_dollar_signs_in_session_data_render_literally(self):
+        for archetype_id in ("desperate_switcher", "car_buyer"):
+            with self.subTest(archetype=archetype_id):
+                state = _header_state(archetype_id, is_retry=True)
+                counsellor = main._static_counsellor_header(state)
+                student = main._static_student_header(state)
+                self.assertIn('named "Data $cience ${Pro}"', counsellor)
+                self.assertIn("Ignored $ concerns", counsellor)
+                self.assertIn("Data $cience ${Pro}", student)
+                self.assertIn("YOUR STORY: Paid $500 for ${course} twice", student)
+                self.assertIn("HIDDEN SECRET: Owes $$ to family", student)
+                self.assertIn("ARCHETYPE: Label $x", student)
+        program_state = _header_state("desperate_switcher")
+        self.assertIn("Save $200 with the $early bird offer", main._static_counsellor_header(program_state))
+        self.assertIn("COMMON VOCABULARY: $$ bills, yaar", main._static_student_header(program_state))
+        product_state = _header_state("car_buyer")
+        self.assertIn("- Financing: 12 month EMI at $0 interest", main._static_counsellor_header(product_state))
+
+
+class _FakeAsyncModels:
+    def __init__(self, args):
+        self.calls = 0
+        self._args = args
+
+    async def generate_content(self, **_kwargs):
+        self.calls += 1
+        call = types.SimpleNamespace(name="set_summary", args=dict(self._args))
+        return types.SimpleNamespace(function_calls=[call], candidates=[])
+
+
+class FunctionCallCacheTests(unittest.TestCase):
+    def setUp(self):
+        main.GEMINI_RESPONSE_CACHE.clear()
+
+    def _client(self):
+        return types.SimpleNamespace(aio=types.SimpleNamespace(models=_FakeAsyncModels({"name": "Program", "tags": ["ai"]})))
+
+    def _call(self, client, cacheable):
+        return asyncio.run(
+            main._acall_function_json(
+                client,
+                "test-model",
+                "same prompt",
+                "set_summary",
+                "Return a summary.",
+                {"type": "object", "properties": {"name": {"type": "string"}}},
+                {"name": "fallback"},
+                cacheable=cacheable,
+            )
+        )
+
+    def test_cacheable_calls_hit_model_once(self):
+        client = self._client()
+        first = self._call(client, cacheable=True)
+        second = self._call(client, cacheable=True)
+        self.assertEqual(client.aio.models.calls, 1)
+        self.assertEqual(first, second)
+
+    def test_cached_results_are_isolated_from_callers(self):
+        client = self._client()
+        first = self._call(client, cacheable=True)
+        first["name"] = "mutated by caller"
+        first["tags"].append("mutated")
+        second = self._call(client, cacheable=True)
+        second["tags"].append("mutated again")
+        third = self._call(client, cacheable=True)
+        self.assertEqual(client.aio.models.calls, 1)
+        self.assertEqual(third, {"name": "Program", "tags": ["ai"]})
+
+    def test_uncacheable_calls_always_hit_model(self):
+        client = self._client()
+        self._call(client, cacheable=False)
+        self._call(client, cacheable=False)
+        self.assertEqual(client.aio.models.calls, 2)
+        self.assertEqual(len(main.GEMINI_RESPONSE_CACHE), 0)
+
+    def test_zero_ttl_disables_cache(self):
+        client = self._client()
+        with mock.patch.object(main, "GEMINI_RESPONSE_CACHE_TTL_SECONDS", 0):
+            self._call(client, cacheable=True)
+            self._call(client, cacheable=True)
+        self.assertEqual(client.aio.models.calls, 2)
+        self.assertEqual(len(main.GEMINI_RESPONSE_CACHE), 0)
+
+
+class StudentStructuredRetryTests(unittest.TestCase):
+    def _run_retry(self):
+        calls = []
+
+        async def fake_call(**kwargs):
+            calls.append(kwargs["function_name"])
+            return {"message": "Is the fee refundable if I drop out after the first month?", "emotional_state": "skeptical"}
+
+        with mock.patch.object(main, "_acall_function_json", fake_call):
+            payload = asyncio.run(
+                main._retry_with_structured_json(
+                    None, "test-model", "student", "CONTEXT", {"name": "Aarav", "archetype_label": "Switcher"}
+                )
+            )
+        return calls, payload
+
+    def test_default_sends_a_single_candidate(self):
+        self.assertEqual(main.STUDENT_RETRY_CANDIDATES, 1)
+        calls, payload = self._run_retry()
+        self.assertEqual(calls, ["set_retry_student_response"])
+        self.assertEqual(payload["emotional_state"], "skeptical")
+
+    def test_fan_out_is_opt_in(self):
+        with mock.patch.object(main, "STUDENT_RETRY_CANDIDATES", 3):
+            calls, _payload = self._run_retry()
+        self.assertEqual(calls, ["set_retry_student_response"] * 3)
+
+
+class _FakeNegotiationSocket:
+    client_state = types.SimpleNamespace(name="CONNECTED")
+
+    def __init__(self, config):
+        self._config = config
+        self.sent = []
+
+    async def accept(self):
+        return None
+
+    async def receive_json(self):
+        return dict(self._config)
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+class NegotiateExceptionTraceTests(unittest.TestCase):
+    def _run_failing_negotiation(self, mode):
+        token = main._issue_auth_token()
+        session_id = f"trace-{mode}"
+        main.SESSION_STORE[session_id] = {"program": {}, "persona": {"archetype_id": "desperate_switcher"}}
+        traces = []
+
+        def record_trace(event, payload):
+            traces.append((event, payload() if callable(payload) else payload))
+
+        def fail_financials(*_args):
+            raise RuntimeError("boom")
+
+        websocket = _FakeNegotiationSocket({"session_id": session_id, "auth_token": token, "mode": mode})
+        with mock.patch.object(main, "_write_debug_trace", record_trace), mock.patch.object(
+            main, "_is_valid_student_persona_schema", lambda _persona: True
+        ), mock.patch.object(main, "_derive_financials", fail_financials):
+            asyncio.run(main.negotiate_websocket(websocket))
+        return [payload for event, payload in traces if event == "negotiate_exception"]
+
+    def test_exception_trace_records_session_mode(self):
+        for mode in ("ai_vs_ai", "human_vs_ai", "agent_powered_human_vs_ai"):
+            with self.subTest(mode=mode):
+                payloads = self._run_failing_negotiation(mode)
+                self.assertEqual(len(payloads), 1)
+                self.assertEqual(payloads[0]["mode"], mode)
+                self.assertEqual(payloads[0]["error_type"], "RuntimeError")
+
+
+class WebSocketFrameEncodingTests(unittest.TestCase):
+    def test_send_json_leaves_payload_numbers_untouched(self):
+        payload = {
+            "type": "analysis",
+            "persona": {"walk_away_likelihood": 0.4537, "budget": 150000.0},
+            "metrics": {"confidence_score": 71.99999, "ratio": 2.0, "close_probability": 64},
+            "history": [{"enrollment_likelihood": 72.46}, 3.0],
+        }
+        websocket = _FakeNegotiationSocket({})
+        asyncio.run(main._ws_send_json(websocket, payload))
+        self.assertEqual(len(websocket.sent), 1)
+        self.assertEqual(main.json.loads(websocket.sent[0]), payload)
+        self.assertIn('"budget":150000.0', websocket.sent[0])
+        self.assertIn('"confidence_score":71.99999', websocket.sent[0])
+
+
 if __name__ == "__main__":
     unittest.main()
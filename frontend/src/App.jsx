@@ -1475,17 +1475,7 @@ function App() {
       );
     };
 
-    ws.onmessage = (event) => {
-      let payload;
-      try {
-        payload = JSON.parse(event.data);
-      } catch (error) {
-        // Keep UI alive and surface malformed payloads in dev tools.
-        // eslint-disable-next-line no-console
-        console.error("WS payload parse failed", { raw: event.data, error });
-        pushUiToast("Malformed server event received.");
-        return;
-      }
+    const handleServerEvent = (payload) => {
       if (payload.type === "session_ready") {
         if (payload.data?.persona) setPersona(payload.data.persona);
         if (payload.data?.program) setProgram(payload.data.program);
@@ -1600,6 +1590,22 @@ function App() {
       }
     };
 
+    ws.onmessage = (event) => {
+      let payload;
+      try {
+        payload = JSON.parse(event.data);
+      } catch (error) {
+        // Keep UI alive and surface malformed payloads in dev tools.
+        // eslint-disable-next-line no-console
+        console.error("WS payload parse failed", { raw: event.data, error });
+        pushUiToast("Malformed server event received.");
+        return;
+      }
+      // Terminal events of a non-streamed turn, and each round's state/metrics pair, arrive coalesced in one "batch" frame, in order.
+      const events = payload.type === "batch" && Array.isArray(payload.data) ? payload.data : [payload];
+      events.forEach(handleServerEvent);
+    };
+
     ws.onerror = (event) => {
       // eslint-disable-next-line no-console
       console.error("WebSocket error", event);